@@ -0,0 +1,148 @@
+"""JSON endpoints for the TOEFL grader, served from the Dash app's Flask server.
+
+POST /api/grade accepts
+    {"text": "..."}                      -> {"score": ..., "features": {...}}
+    {"texts": ["...", ...]}              -> {"results": [{"index": 0, "score": ..., "features": {...}}, ...]}
+    application/x-ndjson, one {"text": "..."} per line, or ?stream=1, or more than
+    STREAM_THRESHOLD texts               -> the results as newline-delimited JSON, in input order
+
+With the grading worker pool on (EP_WORKER_PROCESSES), every request grades in the
+pool: a busy pool answers 503 and a timed-out grading 504, as JSON (or as an error
+line in a stream).
+"""
+
+import itertools
+import json
+
+from flask import Response, jsonify, request, stream_with_context
+
+from english_proficiency_r.worker_pool import PoolBusy, WorkerCrashed
+from tabs import english_proficiency as toefl
+
+NDJSON = "application/x-ndjson"
+STREAM_THRESHOLD = 50
+STREAM_CHUNK = 32
+MAX_TEXT_CHARS = 200_000
+
+
+class BadRequest(ValueError):
+    pass
+
+
+# Grading failures reported as JSON: exception -> HTTP status
+POOL_ERRORS = {PoolBusy: 503, TimeoutError: 504, WorkerCrashed: 500}
+
+
+def _pool_error(error):
+    return jsonify({"error": str(error)}), POOL_ERRORS[type(error)]
+
+
+def _check_text(text):
+    if not isinstance(text, str) or not text.strip():
+        raise BadRequest("each text must be a non-empty string")
+    if len(text) > MAX_TEXT_CHARS:
+        raise BadRequest(f"texts are limited to {MAX_TEXT_CHARS} characters")
+    return toefl.normalize_text(text)
+
+
+def _features_to_json(features):
+    return {name: float(value) for name, value in features.items()}
+
+
+def grade_batch(texts):
+    """
+    Grade texts in chunks of STREAM_CHUNK, yielding one result dict per text in order.
+
+    If texts raises BadRequest (an invalid NDJSON line), the texts before it are still
+    graded and yielded before the error is re-raised.
+
+    Args:
+        texts (iterable of str): Essays, validated as they are produced.
+    """
+    pool = toefl.grading_pool()
+    index = 0
+    texts = iter(texts)
+    while True:
+        chunk, error = [], None
+        try:
+            chunk.extend(itertools.islice(texts, STREAM_CHUNK))
+        except BadRequest as bad_request:
+            error = bad_request
+        if chunk:
+            if pool is not None:
+                rows = pool.grade_batch(chunk)
+            else:
+                from english_proficiency_r import english_proficiency as ep
+                rows = ep.text2pred_batch(chunk).to_dict(orient="records")
+            for row in rows:
+                score = row.pop("score")
+                yield {"index": index, "score": float(score), "features": _features_to_json(row)}
+                index += 1
+        if error is not None:
+            raise error
+        if not chunk:
+            return
+
+
+def _ndjson_texts(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                yield _check_text(json.loads(line).get("text"))
+            except (ValueError, AttributeError):
+                raise BadRequest("each line must be a JSON object with a non-empty \"text\"")
+
+
+def _flag(value):
+    return value is not None and value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _stream(texts):
+    def generate():
+        try:
+            for result in grade_batch(texts):
+                yield json.dumps(result) + "\n"
+        except (BadRequest, *POOL_ERRORS) as error:
+            yield json.dumps({"error": str(error)}) + "\n"
+    return Response(stream_with_context(generate()), mimetype=NDJSON)
+
+
+def add_routes(server):
+    """
+    Register the API routes on the Flask server.
+
+    Args:
+        server (flask.Flask): The Dash app's server.
+    """
+    @server.route("/api/grade", methods=["POST"])
+    def grade():
+        if request.mimetype == NDJSON:
+            return _stream(_ndjson_texts(request.stream))
+
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({"error": "expected a JSON object with \"text\" or \"texts\""}), 400
+        try:
+            if "text" in payload:
+                try:
+                    result = toefl.grade_text(_check_text(payload["text"]))
+                except tuple(POOL_ERRORS) as error:
+                    return _pool_error(error)
+                return jsonify({"score": float(result["score"]), "features": _features_to_json(result["features"])})
+            texts = payload.get("texts")
+            if not isinstance(texts, list) or not texts:
+                raise BadRequest("\"texts\" must be a non-empty list")
+            texts = [_check_text(text) for text in texts]
+        except BadRequest as error:
+            return jsonify({"error": str(error)}), 400
+
+        if len(texts) > STREAM_THRESHOLD or _flag(request.args.get("stream")) or NDJSON in request.headers.get("Accept", ""):
+            return _stream(texts)
+        try:
+            return jsonify({"results": list(grade_batch(texts))})
+        except tuple(POOL_ERRORS) as error:
+            return _pool_error(error)
+
+    @server.route("/api/grade/cache", methods=["GET"])
+    def grading_cache_stats():
+        return jsonify(toefl.cache_stats())
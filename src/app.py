@@ -1,13 +1,21 @@
+import startup_profiler
+
+startup_profiler.install()  # no-op unless PROFILE_STARTUP is set
+
 import warnings
 
 # Ignore warnings from Dash about dcc and html
 warnings.simplefilter("ignore", UserWarning)
 
+import importlib
+import os
+import threading
+
 import dash
 import dash_bootstrap_components as dbc
 from dash import Input, Output, dcc, html
 
-import tabs
+import api
 
 app = dash.Dash(__name__,
                 external_stylesheets=[dbc.themes.FLATLY, "./assets/css/stylesheet.css",
@@ -16,6 +24,7 @@ app = dash.Dash(__name__,
                 update_title="Loading...")
 
 server = app.server
+api.add_routes(server)
 
 SIDEBAR_STYLE = {
     "position": "fixed",
@@ -103,35 +112,68 @@ content = html.Div(id="page-content", style=CONTENT_STYLE)
 
 app.layout = html.Div([dcc.Location(id="url"), sidebar, content])
 
+# Page modules by path. They are imported on first visit (or by the warmup thread),
+# so serving the homepage doesn't pay for every other page's imports.
+PAGES = {
+    "/": "tabs.homepage",
+    "/resume": "tabs.resume",
+    "/about-me": "tabs.about",
+    "/portfolio": "tabs.portfolio",
+    "/portfolio/perception": "tabs.perception",
+    "/portfolio/aphasia": "tabs.aphasia",
+    "/portfolio/toefl": "tabs.english_proficiency",
+    "/scout": "tabs.scout",
+}
+NOT_FOUND_PAGE = "tabs.not_found"
+
+# Dash needs every callback registered before the first request, so pages with
+# callbacks are imported at startup. Keep their module-level imports light.
+CALLBACK_PAGES = ["tabs.homepage", "tabs.aphasia", "tabs.perception", "tabs.english_proficiency"]
+
+# Loaded in the background after the first request so later visits are fast too
+WARMUP_MODULES = list(PAGES.values()) + [NOT_FOUND_PAGE, "english_proficiency_r.english_proficiency"]
+
+
+def page_layout(path):
+    """Import (on first use) and return the layout of the page at path."""
+    return importlib.import_module(PAGES.get(path, NOT_FOUND_PAGE)).LAYOUT
+
+
+def warm_up():
+    for module in WARMUP_MODULES:
+        if module == "english_proficiency_r.english_proficiency" and int(os.environ.get("EP_WORKER_PROCESSES", 0)) > 0:
+            continue  # grading runs in the worker processes
+        try:
+            importlib.import_module(module)
+        except Exception:
+            app.logger.exception("Warmup import of %s failed", module)
+    startup_profiler.write_report("warmup")
+
+
+_warmup_started = threading.Event()
+
+
+@server.before_request
+def start_warmup():
+    # Started from the first request rather than at import, so that it runs in the
+    # gunicorn worker and not in the --preload master before it forks
+    if not _warmup_started.is_set() and os.environ.get("APP_WARMUP", "1") != "0":
+        _warmup_started.set()
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+
+
 @app.callback(
     Output("page-content", "children"),
     Input("url", "pathname")
 )
 def render_page(path):
-    if path == "/":
-        return tabs.homepage.LAYOUT
-    elif path == "/resume":
-        return tabs.resume.LAYOUT
-    elif path == "/about-me":
-        return tabs.about.LAYOUT
-    elif path == "/portfolio":
-        return tabs.portfolio.LAYOUT
-    elif path == "/portfolio/perception":
-        return tabs.perception.LAYOUT
-    elif path == "/portfolio/aphasia":
-        return tabs.aphasia.LAYOUT
-    elif path == "/portfolio/toefl":
-        return tabs.english_proficiency.LAYOUT
-    elif path == "/scout":
-        return tabs.scout.LAYOUT
-    else:
-        return tabs.not_found.LAYOUT
+    return page_layout(path)
 
 # Add callbacks for each custom page here
-tabs.homepage.add_callbacks(app)
-tabs.aphasia.add_callbacks(app)
-tabs.perception.add_callbacks(app)
-tabs.english_proficiency.add_callbacks(app)
+for page in CALLBACK_PAGES:
+    importlib.import_module(page).add_callbacks(app)
+
+startup_profiler.write_report("boot")
 
 
 if __name__ == "__main__":
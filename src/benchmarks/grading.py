@@ -0,0 +1,251 @@
+"""Benchmarks for the TOEFL grading hot path.
+
+Times each stage of the served grading path on a generated corpus of essays from
+short to very long, and writes latency percentiles, peak memory and throughput as
+JSON so runs can be compared. Stages:
+    parse          sentence splitting and nlp.pipe, as on a sentence cache miss
+    features_cold  text2vector with an empty sentence cache (a first grading)
+    features_warm  text2vector with every sentence cached (a re-grade)
+    predict, figures, serialization
+    text2pred      end to end, empty caches
+    text_to_div    end to end as the page serves it, empty caches
+The "huge" essay is past STREAM_MIN_CHARS, so its features go down the streaming path.
+
+Run from src/:
+    python -m benchmarks.grading --out bench.json
+    python -m benchmarks.grading --out new.json --compare bench.json
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Essay lengths in words, from a short paragraph to a pasted book chapter
+CORPUS_SIZES = {"short": 50, "typical": 350, "long": 1500, "very_long": 6000, "huge": 25000}
+STAGES = ("parse", "features_cold", "features_warm", "predict", "figures", "serialization",
+          "text2pred", "text_to_div")
+
+
+def generate_corpus(sizes=CORPUS_SIZES, seed=0, source="english_proficiency_r/example_submission.txt"):
+    """
+    Build essays of the requested lengths by sampling sentences of the example submission.
+
+    Args:
+        sizes (dict): Essay name -> target number of words.
+        seed (int, optional): Random seed, so runs grade identical text. Defaults to 0.
+        source (str, optional): Text the sentences are drawn from.
+
+    Returns:
+        dict: Essay name -> essay text.
+    """
+    from english_proficiency_r.english_proficiency import split_sentences
+
+    with open(source) as file:
+        sentences = [sentence.strip() for sentence in split_sentences(file.read()) if sentence.strip()]
+    rng = random.Random(seed)
+    corpus = {}
+    for name, target_words in sizes.items():
+        words, picked = 0, []
+        while words < target_words:
+            sentence = rng.choice(sentences)
+            picked.append(sentence)
+            words += len(sentence.split())
+        corpus[name] = " ".join(picked)
+    return corpus
+
+
+def _empty_caches():
+    # Fresh in-memory caches, so cold runs never read (or fill) a persistent EP_CACHE_DIR
+    from cache import ResultCache
+    from english_proficiency_r import english_proficiency as ep
+    from tabs import english_proficiency as toefl
+
+    ep.SENTENCE_CACHE = ResultCache(max_bytes=ep.SENTENCE_CACHE.max_bytes)
+    toefl.GRADING_CACHE = ResultCache(max_bytes=toefl.GRADING_CACHE.max_bytes)
+
+
+def _stage_functions(text):
+    """
+    Return (stage, fn, setup) triples; fn runs one stage on the previous stages' output and
+    setup (or None) runs untimed before every run of fn.
+    """
+    from plotly.utils import PlotlyJSONEncoder
+
+    from english_proficiency_r import english_proficiency as ep
+    from tabs import english_proficiency as toefl
+
+    state = {}
+
+    def parse():
+        state["arrays"] = [ep.doc_arrays(doc) for doc in ep.nlp.pipe(ep.split_sentences(text))]
+
+    def features():
+        state["values"] = ep.text2vector(text)
+
+    def predict():
+        state["score"] = ep.predict_scores(pd.DataFrame(state["values"][None, :], columns=ep.FEATURE_COLUMNS))[0]
+
+    def figures():
+        state["figures"] = ep.get_figs(state["values"], ep.english)
+
+    def serialization():
+        layout = toefl.result_to_div({"score": state["score"], "figures": state["figures"]})
+        state["payload"] = json.dumps(layout, cls=PlotlyJSONEncoder)
+
+    def text2pred():
+        ep.text2pred(text)
+
+    def text_to_div():
+        json.dumps(toefl.text_to_div(text), cls=PlotlyJSONEncoder)
+
+    return list(zip(STAGES, (parse, features, features, predict, figures, serialization, text2pred, text_to_div),
+                    (None, _empty_caches, None, None, None, None, _empty_caches, _empty_caches)))
+
+
+def _repeats_for(words, base_repeats):
+    return max(3, int(base_repeats * min(1, 1000 / max(words, 1))))
+
+
+def run_benchmarks(corpus, repeats=20):
+    """
+    Time every stage on every essay.
+
+    Args:
+        corpus (dict): Essay name -> text, e.g. from generate_corpus.
+        repeats (int, optional): Timed runs for essays up to 1000 words; longer essays get
+            proportionally fewer (at least 3). Defaults to 20.
+
+    Returns:
+        list: One result dict per (essay, stage).
+    """
+    results = []
+    for name, text in corpus.items():
+        words = len(text.split())
+        stages = _stage_functions(text)
+        for _, fn, _ in stages:  # warm up and populate every stage's input
+            fn()
+        for stage, fn, setup in stages:
+            latencies = []
+            for _ in range(_repeats_for(words, repeats)):
+                if setup:
+                    setup()
+                start = time.perf_counter()
+                fn()
+                latencies.append(time.perf_counter() - start)
+            if setup:
+                setup()
+            tracemalloc.start()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            latencies = np.array(latencies) * 1000
+            results.append({
+                "essay": name,
+                "words": words,
+                "stage": stage,
+                "runs": len(latencies),
+                "mean_ms": float(latencies.mean()),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p90_ms": float(np.percentile(latencies, 90)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "peak_kb": peak / 1024,
+                "essays_per_s": float(1000 / latencies.mean()),
+                "words_per_s": float(words * 1000 / latencies.mean()),
+            })
+    return results
+
+
+def environment():
+    """Describe the machine and library versions a run was made with."""
+    import sklearn
+    import spacy
+
+    from english_proficiency_r import english_proficiency as ep
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "spacy": spacy.__version__,
+        "sklearn": sklearn.__version__,
+        "numpy": np.__version__,
+        "pipeline_profile": ep.PIPELINE_PROFILE,
+        "model_version": ep.MODEL_VERSION,
+    }
+
+
+def compare(baseline, current, threshold=0.2, metric="p50_ms"):
+    """
+    Find stages that got slower than the baseline run.
+
+    Args:
+        baseline (dict): Earlier benchmark output.
+        current (dict): New benchmark output.
+        threshold (float, optional): Allowed relative slowdown. Defaults to 0.2 (20%).
+        metric (str, optional): Result field to compare. Defaults to "p50_ms".
+
+    Returns:
+        list: (essay, stage, baseline value, current value) for every regression.
+    """
+    before = {(row["essay"], row["stage"]): row[metric] for row in baseline["results"]}
+    regressions = []
+    for row in current["results"]:
+        old = before.get((row["essay"], row["stage"]))
+        if old is not None and row[metric] > old * (1 + threshold):
+            regressions.append((row["essay"], row["stage"], old, row[metric]))
+    return regressions
+
+
+def print_table(results):
+    print(f"{'essay':>10} {'words':>6} {'stage':>13} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+          f"{'peak KB':>9} {'essays/s':>9}")
+    for row in results:
+        print(f"{row['essay']:>10} {row['words']:>6} {row['stage']:>13} {row['p50_ms']:>9.2f} "
+              f"{row['p90_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['peak_kb']:>9.0f} {row['essays_per_s']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TOEFL grading path.")
+    parser.add_argument("--out", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Earlier results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown (default 0.2)")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--sizes", nargs="+", choices=list(CORPUS_SIZES), help="Only run these essay sizes")
+    args = parser.parse_args()
+
+    sizes = {name: CORPUS_SIZES[name] for name in args.sizes} if args.sizes else CORPUS_SIZES
+    report = {"environment": environment(),
+              "results": run_benchmarks(generate_corpus(sizes), args.repeats)}
+    print_table(report["results"])
+
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(json.load(file), report, args.threshold)
+        for essay, stage, old, new in regressions:
+            print(f"REGRESSION {essay}/{stage}: {old:.2f} ms -> {new:.2f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Speed and palette quality of the color extractor's clustering engines.
+
+Runs every engine in tabs.color_extractor.PALETTE_ENGINES on the same resized
+photos and reports, per engine:
+    - latency of get_clusters and of the whole extract_colors call
+    - quantization error: mean CAM02-UCS distance (delta-E) from each pixel to its cluster center
+    - palette delta-E: mean distance from each center of the baseline engine (kmeans)
+      to the nearest center the engine found
+It also times the sRGB to CAM02-UCS conversion through the lookup table against
+colorspacious, and checks the table's largest error.
+
+Run from src/:
+    python -m benchmarks.palette --out palette.json
+    python -m benchmarks.palette --max-size 300 assets/scout_pics/*.png
+    python -m benchmarks.palette --cam-lut /tmp/cam02ucs_lut.npy
+"""
+
+import argparse
+import glob
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_IMAGES = "assets/mitch_pics/*.png"
+BASELINE_ENGINE = "kmeans"
+
+
+def _time(fn, repeats):
+    latencies, result = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies) * 1000, result
+
+
+def palette_delta_e(baseline_centers, centers):
+    """Mean distance from each baseline center to the nearest of centers."""
+    distances = np.linalg.norm(baseline_centers[:, None, :] - centers[None, :, :], axis=2)
+    return float(distances.min(axis=1).mean())
+
+
+def run_benchmarks(paths, engines, max_img_size=150, n_clusters=10, repeats=5):
+    """
+    Time and score every engine on every image.
+
+    Args:
+        paths (list): Image files.
+        engines (tuple): Engine names; the first one is the palette delta-E baseline.
+        max_img_size (int, optional): Images are resized like extract_colors does. Defaults to 150.
+        n_clusters (int, optional): Clusters per image. Defaults to 10.
+        repeats (int, optional): Timed runs per engine and image. Defaults to 5.
+
+    Returns:
+        list: One result dict per (image, engine).
+    """
+    from tabs import color_extractor
+
+    results = []
+    for path in paths:
+        image = Image.open(path)
+        image.load()
+        colors, counts = color_extractor.image_to_cam_counts(color_extractor.resize_image(image, max_img_size))
+        baseline_centers = None
+        for engine in engines:
+            latencies, (labels, centers) = _time(lambda: color_extractor.get_clusters(
+                colors, min(n_clusters, len(colors)), engine, sample_weight=counts), repeats)
+            extract_ms, _ = _time(lambda: color_extractor.extract_colors(
+                image, max_img_size, n_clusters, engine=engine), repeats)
+            if baseline_centers is None:
+                baseline_centers = centers
+            results.append({
+                "image": path,
+                "pixels": int(counts.sum()),
+                "colors": len(colors),
+                "engine": engine,
+                "clusters_p50_ms": float(np.percentile(latencies, 50)),
+                "extract_p50_ms": float(np.percentile(extract_ms, 50)),
+                "quantization_delta_e": float(np.average(np.linalg.norm(colors - centers[labels], axis=1),
+                                                         weights=counts)),
+                "palette_delta_e": palette_delta_e(baseline_centers, centers),
+            })
+    return results
+
+
+def benchmark_conversion(paths, max_img_size=150, repeats=5):
+    """
+    Time image_to_cam_array's conversion with the lookup table and with colorspacious.
+
+    The table at color_extractor.CAM_LUT_PATH is built first if it doesn't exist.
+
+    Returns:
+        dict: Mean p50 milliseconds per image for both, and the table's largest delta-E error.
+    """
+    import colorspacious
+
+    from tabs import color_extractor
+
+    color_extractor.cam_lut()  # build or map the table outside the timings
+    lut_ms, colorspacious_ms = [], []
+    for path in paths:
+        rgb = np.array(color_extractor.resize_image(Image.open(path), max_img_size).convert("RGB"))
+        lut_ms.append(np.percentile(_time(lambda: color_extractor.srgb_to_cam(rgb), repeats)[0], 50))
+        colorspacious_ms.append(np.percentile(
+            _time(lambda: colorspacious.cspace_convert(rgb, "sRGB255", "CAM02-UCS"), repeats)[0], 50))
+    return {"lut_p50_ms": float(np.mean(lut_ms)), "colorspacious_p50_ms": float(np.mean(colorspacious_ms)),
+            "lut_max_delta_e": color_extractor.check_cam_lut()}
+
+
+def summarize(results):
+    """Average every metric per engine across images."""
+    summary = {}
+    for engine in dict.fromkeys(row["engine"] for row in results):
+        rows = [row for row in results if row["engine"] == engine]
+        summary[engine] = {key: float(np.mean([row[key] for row in rows]))
+                           for key in ("clusters_p50_ms", "extract_p50_ms", "quantization_delta_e", "palette_delta_e")}
+    return summary
+
+
+def print_table(summary):
+    print(f"{'engine':>11} {'clusters ms':>12} {'extract ms':>11} {'quant dE':>9} {'palette dE':>11}")
+    for engine, row in summary.items():
+        print(f"{engine:>11} {row['clusters_p50_ms']:>12.1f} {row['extract_p50_ms']:>11.1f} "
+              f"{row['quantization_delta_e']:>9.2f} {row['palette_delta_e']:>11.2f}")
+
+
+def main():
+    from tabs.color_extractor import PALETTE_ENGINES
+
+    parser = argparse.ArgumentParser(description="Compare the color extractor's clustering engines.")
+    parser.add_argument("images", nargs="*", help=f"Image files (default {DEFAULT_IMAGES})")
+    parser.add_argument("--engines", nargs="+", choices=PALETTE_ENGINES, default=list(PALETTE_ENGINES))
+    parser.add_argument("--max-size", type=int, default=150, help="Resize images to this many pixels (default 150)")
+    parser.add_argument("--clusters", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--out", help="Write results to this JSON file")
+    parser.add_argument("--cam-lut", help="Lookup table to build or reuse for the conversion benchmark "
+                                          "(default $CAM_LUT_PATH, else tabs/cam02ucs_lut.npy)")
+    args = parser.parse_args()
+
+    from tabs import color_extractor
+    color_extractor.CAM_LUT_PATH = (args.cam_lut or color_extractor.CAM_LUT_PATH
+                                    or color_extractor.DEFAULT_CAM_LUT_PATH)
+
+    engines = [BASELINE_ENGINE] + [engine for engine in args.engines if engine != BASELINE_ENGINE]
+    paths = args.images or sorted(glob.glob(DEFAULT_IMAGES))
+    results = run_benchmarks(paths, engines, args.max_size, args.clusters, args.repeats)
+    summary = summarize(results)
+    print_table(summary)
+    conversion = benchmark_conversion(paths, args.max_size, args.repeats)
+    print(f"sRGB -> CAM02-UCS: lookup table {conversion['lut_p50_ms']:.2f} ms, colorspacious "
+          f"{conversion['colorspacious_p50_ms']:.2f} ms, max error {conversion['lut_max_delta_e']:.1e} delta-E")
+
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump({"summary": summary, "conversion": conversion, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
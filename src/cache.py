@@ -0,0 +1,191 @@
+"""Size-bounded LRU result cache with a TTL and an optional on-disk tier."""
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(*parts):
+    """
+    Build a content-addressed cache key.
+
+    Args:
+        *parts: str or bytes pieces identifying the input (text, parameters, ...).
+
+    Returns:
+        str: sha256 hex digest of the parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache bounded by total pickled size, with expiring entries.
+
+    Values are kept pickled so their size is known exactly. If disk_dir is given,
+    entries are also written there (one file per key) so they survive worker
+    restarts; the disk tier is bounded by max_disk_bytes and evicts the least
+    recently used files first. The directory is only scanned when the running
+    total of bytes written goes over max_disk_bytes, so processes sharing it can
+    overshoot the bound until one of them scans.
+    """
+
+    def __init__(self, max_bytes=32 << 20, ttl=24 * 3600, disk_dir=None, max_disk_bytes=256 << 20):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, pickled value)
+        self._bytes = 0
+        self._disk_bytes = None  # bytes in disk_dir as of the last scan, plus writes since
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return pickle.loads(entry[1])
+                self._drop(key)
+        entry = self._disk_get(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return default
+            self.disk_hits += 1
+            self._store(key, *entry)
+        return pickle.loads(entry[1])
+
+    def set(self, key, value):
+        """Cache value under key."""
+        entry = (time.time() + self.ttl, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._store(key, *entry)
+        self._disk_set(key, entry)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, computing and caching it on a miss."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        """Return hit/miss counters and current size, for sizing the cache."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _store(self, key, expires_at, blob):
+        if len(blob) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (expires_at, blob)
+        self._bytes += len(blob)
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        self._bytes -= len(self._entries.pop(key)[1])
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + ".pkl")
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as file:
+                expires_at, blob = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        if expires_at <= now:
+            self._disk_remove(path)
+            return None
+        try:
+            os.utime(path)  # mtime doubles as the LRU timestamp
+        except OSError:
+            pass
+        return expires_at, blob
+
+    def _disk_set(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        try:
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+                written = file.tell()
+            os.replace(tmp_path, path)
+        except OSError:
+            self._disk_remove(tmp_path)
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += written - replaced
+            if self._disk_bytes is not None and self._disk_bytes <= self.max_disk_bytes:
+                return
+        self._disk_evict()
+
+    def _disk_evict(self):
+        stats = []
+        try:
+            for entry in os.scandir(self.disk_dir):
+                if entry.name.endswith(".pkl"):
+                    stat = entry.stat()
+                    stats.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in stats)
+        # Evict down to 90% of the bound so the next scan is a tenth of the bound away
+        target = self.max_disk_bytes if total <= self.max_disk_bytes else self.max_disk_bytes * 0.9
+        for _, size, path in sorted(stats):
+            if total <= target:
+                break
+            self._disk_remove(path)
+            total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    @staticmethod
+    def _disk_remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -1,49 +1,348 @@
+import itertools
+import json
+import os
+import re
+
 import numpy as np
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
 import spacy
-import yaml
-from sklearn.ensemble import RandomForestRegressor
-import pickle
+from spacy.attrs import LEMMA, LOWER, ORTH, POS
+from spacy.parts_of_speech import IDS
 
-nlp = spacy.load("en_core_web_sm")
-try:
-    nlp.add_pipe('sentencizer')
-except:
-    nlp.add_pipe(nlp.create_pipe('sentencizer'))
+from cache import ResultCache, content_key
 
-with open("english_proficiency_r/hedges_boosters.yml") as file:
-    hb_dict = yaml.load(file, Loader=yaml.FullLoader)
+from . import forest, hedges, model_registry
 
-imp = pd.read_csv('english_proficiency_r/rf_importance.csv')
-english = pd.read_csv("english_proficiency_r/english_results_subset.csv")
+# Components of en_core_web_sm each profile leaves out. Grading only uses tokens,
+# coarse POS, lemmas and sentence boundaries, so the parser and NER can go.
+PIPELINE_PROFILES = {
+    "full": [],
+    "grading": ["parser", "ner"],
+}
+PIPELINE_PROFILE = os.environ.get("EP_PIPELINE_PROFILE", "grading")
 
-try:
-    with open('english_proficiency_r/random_forest_model.pkl', 'rb') as file:
-        rf = pickle.load(file)
-except:
-    rf = RandomForestRegressor(random_state=42)
-    rf.fit(english.drop("test_score", axis=1), english["test_score"])
 
+def load_pipeline(profile=PIPELINE_PROFILE):
+    """
+    Load the spaCy pipeline for a profile in PIPELINE_PROFILES.
 
-def spacy_parse(text):
+    Args:
+        profile (str, optional): Profile name. Defaults to $EP_PIPELINE_PROFILE or "grading".
+
+    Returns:
+        spacy.Language: Loaded pipeline with a sentencizer appended.
     """
-    Parse text using spaCy.
+    pipeline = spacy.load("en_core_web_sm", exclude=PIPELINE_PROFILES[profile])
+    try:
+        pipeline.add_pipe('sentencizer')
+    except:
+        pipeline.add_pipe(pipeline.create_pipe('sentencizer'))
+    return pipeline
+
+
+nlp = load_pipeline()
+
+hb_matcher = hedges.load_matcher(nlp)
+
+imp = pd.read_csv(model_registry.artifact_path("importance"))
+english = pd.read_csv(model_registry.artifact_path("reference"))
+FEATURE_COLUMNS = english.drop("test_score", axis=1).columns
+
+# Loaded once per process; only refit if the stored model is missing or stale
+rf = model_registry.load_model(english)
+MODEL_VERSION = (model_registry.load_manifest() or {}).get("version")
+# Array copy of the forest for small inputs, where sklearn's per-call overhead dominates
+FOREST = forest.flatten_forest(rf)
+FOREST_MAX_ROWS = 16
+
+# Essays are parsed sentence by sentence everywhere (see text2vector); parses of
+# sentences seen before are reused when an edited essay is graded again
+SENTENCE_BREAK = re.compile(r'[.!?]+["\')\]]*\s+')
+SENTENCE_CACHE = ResultCache(max_bytes=int(os.environ.get("EP_SENTENCE_CACHE_MAX_BYTES", 32 << 20)))
+
+# Texts longer than this skip the sentence cache and are reduced to running counts
+STREAM_MIN_CHARS = int(os.environ.get("EP_STREAM_MIN_CHARS", 100_000))
+# Sentences longer than this are cut further (see split_chunks), well below nlp.max_length
+STREAM_CHUNK_CHARS = 20_000
+# Sentences of a long text merged before they are added to its FeatureCounter
+COUNT_GROUP_SENTENCES = 256
+PARAGRAPH_BREAK = re.compile(r'\n[^\S\n]*\n\s*')
+WHITESPACE = re.compile(r'\s+')
+
+
+def doc_to_frame(doc):
+    """
+    Convert a parsed spaCy Doc into a token table.
 
     Args:
-        text (str): Input text.
+        doc (spacy.tokens.Doc): Parsed document.
 
     Returns:
         pd.DataFrame: DataFrame with token, part of speech, and lemma columns.
     """
-    doc = nlp(text)
-    #sentences = [sent.string.strip() for sent in doc.sents]
     tokens = [token.text for token in doc]
     pos = [token.pos_ for token in doc]
     lemma = [token.lemma_ for token in doc]
     df = pd.DataFrame({"token": tokens, "pos": pos, "lemma": lemma})
     return df
 
+def spacy_parse(text):
+    """
+    Parse text using spaCy.
+
+    Args:
+        text (str): Input text.
+
+    Returns:
+        pd.DataFrame: DataFrame with token, part of speech, and lemma columns.
+    """
+    return doc_to_frame(nlp(text))
+
+def _feature_plan(columns):
+    """
+    Work out how each feature column is counted from a Doc.
+
+    Columns named after a coarse POS tag ("ADJ") are unigram counts, "ADJ-PART" style
+    columns are POS bigram counts, and any other lowercase name ("of", "would") counts
+    occurrences of that word.
+
+    Args:
+        columns (list): Feature column names, in model order.
+
+    Returns:
+        dict: Index arrays used by doc2vector.
+    """
+    unigrams, bigrams, words = [], [], []
+    for i, column in enumerate(columns):
+        if column in SPECIAL_FEATURES:
+            continue
+        parts = column.split("-")
+        if column in POS_INDEX:
+            unigrams.append((i, POS_INDEX[column]))
+        elif len(parts) == 2 and all(part in POS_INDEX for part in parts):
+            bigrams.append((i, POS_INDEX[parts[0]] * N_POS + POS_INDEX[parts[1]]))
+        else:
+            words.append((i, nlp.vocab.strings.add(column)))
+    as_arrays = lambda pairs, dtype: (np.array([p[0] for p in pairs], dtype=np.intp),
+                                      np.array([p[1] for p in pairs], dtype=dtype))
+    return {
+        "unigrams": as_arrays(unigrams, np.intp),
+        "bigrams": as_arrays(bigrams, np.intp),
+        "words": as_arrays(words, np.uint64),
+        "index": {column: i for i, column in enumerate(columns)},
+    }
+
+
+# Coarse POS symbol ids (as returned by Doc.to_array) mapped to a compact 0..N_POS-1 range
+POS_INDEX = {name: i for i, name in enumerate(sorted(IDS, key=IDS.get))}
+N_POS = len(POS_INDEX)
+POS_LOOKUP = np.zeros(max(IDS.values()) + 1, dtype=np.intp)
+for _name, _symbol in IDS.items():
+    POS_LOOKUP[_symbol] = POS_INDEX[_name]
+NON_WORD_POS = np.array([POS_INDEX["PUNCT"], POS_INDEX["SPACE"]])
+# Lookup table instead of np.isin, whose fixed cost dominates on sentence-sized arrays
+IS_WORD_POS = np.ones(N_POS, dtype=bool)
+IS_WORD_POS[NON_WORD_POS] = False
+SENTENCE_ENDS = np.array([nlp.vocab.strings.add(p) for p in (".", "!", "?")], dtype=np.uint64)
+SPECIAL_FEATURES = {"uniquewords", "words", "sentences", "av_word_len", "confidencehedged", "confidencehigh"}
+FEATURE_PLAN = _feature_plan(list(FEATURE_COLUMNS))
+HEDGE_MAX_LEN = hedges.max_phrase_length(hb_matcher)
+LEMMA_LENGTHS = {}
+
+
+def _lemma_lengths(lemma_hashes, strings):
+    """
+    Look up the character length of each lemma, caching lengths by string hash.
+
+    Args:
+        lemma_hashes (np.array): LEMMA attribute values from Doc.to_array.
+        strings (spacy.strings.StringStore): String store of the Doc's vocab.
+
+    Returns:
+        np.array: Length of each lemma.
+    """
+    unique, inverse = np.unique(lemma_hashes, return_inverse=True)
+    lengths = np.empty(len(unique))
+    for i, key in enumerate(unique.tolist()):
+        length = LEMMA_LENGTHS.get(key)
+        if length is None:
+            length = LEMMA_LENGTHS[key] = len(strings[key])
+        lengths[i] = length
+    return lengths[inverse]
+
+def doc_arrays(doc):
+    """
+    Extract the per-token arrays the features are computed from.
+
+    Args:
+        doc (spacy.tokens.Doc): Parsed text.
+
+    Returns:
+        dict: "pos" (compact POS ids), "lower" (LOWER hashes), "sentence_end" (token is
+        ., ! or ?) and "lemma_len" (lemma length, 0 for punctuation and whitespace).
+    """
+    attrs = doc.to_array([POS, LOWER, ORTH, LEMMA]).reshape(-1, 4)
+    pos = POS_LOOKUP[attrs[:, 0]]
+    is_word = IS_WORD_POS[pos]
+    lemma_len = np.zeros(len(pos), dtype=np.int32)
+    if is_word.any():
+        lemma_len[is_word] = _lemma_lengths(attrs[is_word, 3], doc.vocab.strings)
+    return {
+        "pos": pos.astype(np.int8),
+        "lower": attrs[:, 1],
+        "sentence_end": (attrs[:, 2, None] == SENTENCE_ENDS).any(axis=1),
+        "lemma_len": lemma_len,
+    }
+
+def concat_arrays(pieces):
+    """
+    Join token arrays of consecutive pieces of a text, as if it had been parsed whole.
+
+    Args:
+        pieces (list): Outputs of doc_arrays, in text order.
+
+    Returns:
+        dict: Concatenated arrays.
+    """
+    if not pieces:
+        return doc_arrays(nlp.make_doc(""))
+    return {key: np.concatenate([piece[key] for piece in pieces]) for key in pieces[0]}
+
+class FeatureCounter:
+    """
+    Running feature counts over consecutive pieces of one text.
+
+    Memory stays proportional to the vocabulary, not the text: each piece's token
+    arrays are reduced to counts as soon as they are added. POS bigrams and hedge
+    phrases that span two pieces are counted as if the text had been parsed whole.
+    """
+
+    def __init__(self):
+        self.unigrams = np.zeros(N_POS, dtype=np.int64)
+        self.bigrams = np.zeros(N_POS * N_POS, dtype=np.int64)
+        self.word_counts = np.zeros(len(FEATURE_PLAN["words"][0]), dtype=np.int64)
+        self.unique_words = set()
+        self.words = 0
+        self.lemma_chars = 0
+        self.sentences = 0
+        self.phrases = np.zeros(len(hedges.CATEGORIES), dtype=np.int64)
+        self._last_pos = None
+        self._pending_keys = []
+
+    def add(self, arrays):
+        """
+        Count the tokens of the next piece of text.
+
+        Args:
+            arrays (dict): Output of doc_arrays for the piece.
+        """
+        pos = arrays["pos"].astype(np.intp)
+        if len(pos) == 0:
+            return
+        self.unigrams += np.bincount(pos, minlength=N_POS)
+        if self._last_pos is not None:
+            self.bigrams[self._last_pos * N_POS + pos[0]] += 1
+        self.bigrams += np.bincount(pos[:-1] * N_POS + pos[1:], minlength=N_POS * N_POS)
+        self._last_pos = pos[-1]
+
+        is_word = IS_WORD_POS[pos]
+        lower = arrays["lower"][is_word]
+        word_hashes = FEATURE_PLAN["words"][1]
+        self.word_counts += (lower[:, None] == word_hashes[None, :]).sum(axis=0)
+        self.unique_words.update(lower.tolist())
+        self.words += len(lower)
+        self.lemma_chars += int(arrays["lemma_len"][is_word].sum())
+        self.sentences += int(arrays["sentence_end"].sum())
+
+        # Phrases starting near the end of the piece may continue into the next one
+        keys = self._pending_keys + arrays["lower"].tolist()
+        counts, stop = hedges.scan_phrases(hb_matcher, keys, len(keys) - HEDGE_MAX_LEN + 1)
+        self.phrases += counts
+        self._pending_keys = keys[stop:]
+
+    def vector(self):
+        """
+        Features of all text added so far.
+
+        Returns:
+            np.array: Feature values ordered like FEATURE_COLUMNS.
+        """
+        values = np.zeros(len(FEATURE_COLUMNS))
+        index = FEATURE_PLAN["index"]
+        if self._last_pos is None:
+            return values
+
+        cols, ids = FEATURE_PLAN["unigrams"]
+        values[cols] = self.unigrams[ids]
+        cols, codes = FEATURE_PLAN["bigrams"]
+        values[cols] = self.bigrams[codes]
+        values[FEATURE_PLAN["words"][0]] = self.word_counts
+
+        values[index["uniquewords"]] = len(self.unique_words)
+        values[index["words"]] = self.words
+        if self.words:
+            values[index["av_word_len"]] = self.lemma_chars / self.words
+        values[index["sentences"]] = self.sentences
+
+        hedged, high = self.phrases + hedges.count_phrases(hb_matcher, self._pending_keys)
+        values[index["confidencehedged"]] = hedged
+        values[index["confidencehigh"]] = high
+        return values
+
+def arrays2vector(arrays):
+    """
+    Compute the model features from token arrays in a single pass.
+
+    Args:
+        arrays (dict): Output of doc_arrays or concat_arrays.
+
+    Returns:
+        np.array: Feature values ordered like FEATURE_COLUMNS.
+    """
+    counter = FeatureCounter()
+    counter.add(arrays)
+    return counter.vector()
+
+def doc2vector(doc):
+    """
+    Compute the model features for a parsed essay.
+
+    Args:
+        doc (spacy.tokens.Doc): Parsed essay.
+
+    Returns:
+        np.array: Feature values ordered like FEATURE_COLUMNS.
+    """
+    return arrays2vector(doc_arrays(doc))
+
+def doc2features(doc):
+    """
+    Compute the model features for a parsed essay.
+
+    Args:
+        doc (spacy.tokens.Doc): Parsed essay.
+
+    Returns:
+        pd.DataFrame: Single-row DataFrame with one column per feature.
+    """
+    return pd.DataFrame(doc2vector(doc)[None, :], columns=FEATURE_COLUMNS)
+
+def predict_scores(features):
+    """
+    Score feature rows with the grading model.
+
+    Args:
+        features (pd.DataFrame): Rows with (at least) the FEATURE_COLUMNS columns.
+
+    Returns:
+        np.array: Probability of passing for each row, in percent.
+    """
+    X = features[FOREST["feature_names"] or FEATURE_COLUMNS]
+    raw = forest.predict(FOREST, X.to_numpy()) if len(X) <= FOREST_MAX_ROWS else rf.predict(X)
+    return np.clip(raw, 0, 1) * 100
+
 def text2pred(text):
     """
     Perform text analysis and make predictions.
@@ -54,77 +353,277 @@ def text2pred(text):
     Returns:
         tuple: Prediction, pos_cols DataFrame, english DataFrame, and imp DataFrame.
     """
-    df = spacy_parse(text)
-    df["nextpos"] = df["pos"].shift(-1)
-    df["bigram"] = df["pos"] + "." + df["nextpos"]
-    pos_cols = pd.DataFrame(np.zeros((1, len(english.columns))), columns=english.columns)
+    pos_cols = pd.DataFrame(text2vector(text)[None, :], columns=FEATURE_COLUMNS)
+    pred = predict_scores(pos_cols)
 
-    t = pd.Series(df["pos"]).value_counts()
-    pos_cols.loc[0, t.index] = t.values
+    return pred[0], pos_cols, english
 
-    b = pd.Series(df["bigram"]).value_counts()
-    pos_cols.loc[0, b.index] = b.values
+def grade_result(text):
+    """
+    Grade an essay and build its feedback.
 
-    pos_cols["uniquewords"] = df.loc[(df["pos"] != "PUNCT") & (df["pos"] != "SPACE"), "token"].str.lower().nunique()
-    pos_cols["av_word_len"] = df.loc[(df["pos"] != "PUNCT") & (df["pos"] != "SPACE"), "lemma"].str.len().mean()
-    pos_cols["words"] = len(df.loc[(df["pos"] != "PUNCT") & (df["pos"] != "SPACE")])
-    pos_cols["sentences"] = len(df.loc[df["token"].isin([".", "!", "?"])])
+    Args:
+        text (str): Input text.
 
-    doc = nlp(text)
-    hb_tokens = [hb_dict.get(token.text, 1) for token in doc]
-    pos_cols["confidencehedged"] = sum(token == "ConfidenceHedged" for token in hb_tokens)
-    pos_cols["confidencehigh"] = sum(token == "ConfidenceHigh" for token in hb_tokens)
-    pos_cols = pos_cols.fillna(0)
+    Returns:
+        dict: "score" (percent), "features" (feature name -> value), "figures" (plotly dicts)
+        and "model_version" (manifest version of the model that graded it).
+    """
+    pred, pos_cols, english = text2pred(text)
+    return {"score": float(pred),
+            "features": {name: float(value) for name, value in pos_cols.iloc[0].items()},
+            "figures": get_figs(pos_cols.to_numpy()[0], english),
+            "model_version": MODEL_VERSION}
 
-    rf = RandomForestRegressor(random_state=42)
-    rf.fit(english.drop("test_score", axis=1), english["test_score"])
+def text2pred_batch(texts, batch_size=256, n_process=1):
+    """
+    Grade many essays at once, parsing their sentences as one stream with nlp.pipe.
 
+    The features are the same as text2vector's; only the sentence cache is skipped.
 
-    pred = np.clip(rf.predict(pos_cols[english.columns].drop("test_score", axis=1)), 0, 1) * 100
+    Args:
+        texts (iterable of str): Essays to grade.
+        batch_size (int, optional): Number of sentences spaCy buffers per batch. Defaults to 256.
+        n_process (int, optional): Number of processes used for parsing. Defaults to 1.
 
-    return pred[0], pos_cols, english
+    Returns:
+        pd.DataFrame: One row per essay with the feature columns and a "score" column.
+    """
+    pieces = [split_sentences(text) for text in texts]
+    docs = nlp.pipe(itertools.chain.from_iterable(pieces), batch_size=batch_size, n_process=n_process)
+    rows = [arrays2vector(concat_arrays([doc_arrays(doc) for doc in itertools.islice(docs, len(sentences))]))
+            for sentences in pieces]
+    features = pd.DataFrame(np.array(rows).reshape(-1, len(FEATURE_COLUMNS)), columns=FEATURE_COLUMNS)
+    features["score"] = predict_scores(features)
+    return features
 
-def get_figs(pos_cols, english):
+def split_sentences(text):
     """
-    Generate histograms with vertical lines for top features.
+    Split text into sentence-sized pieces at whitespace following ., ! or ?.
+
+    Each piece keeps its trailing whitespace, so the pieces tokenize exactly like the
+    whole text. Sentences longer than STREAM_CHUNK_CHARS are cut further by split_chunks.
+
+    Args:
+        text (str): Input text.
+
+    Returns:
+        list: Pieces of text that join back into the input.
+    """
+    ends = [match.end() for match in SENTENCE_BREAK.finditer(text)]
+    starts = [0] + ends
+    return [piece for start, end in zip(starts, ends + [len(text)]) if end > start
+            for piece in split_chunks(text[start:end])]
+
+def parse_sentences(sentences):
+    """
+    Get token arrays for each sentence, parsing only sentences not seen before.
+
+    Args:
+        sentences (list): Sentence strings from split_sentences.
+
+    Returns:
+        list: doc_arrays output for each sentence, in order.
+    """
+    keys = [content_key("sentence", PIPELINE_PROFILE, sentence) for sentence in sentences]
+    arrays = [SENTENCE_CACHE.get(key) for key in keys]
+    missing = {}
+    for i, found in enumerate(arrays):
+        if found is None:
+            missing.setdefault(sentences[i], []).append(i)
+    for positions, doc in zip(missing.values(), nlp.pipe(missing)):
+        parsed = doc_arrays(doc)
+        SENTENCE_CACHE.set(keys[positions[0]], parsed)
+        for i in positions:
+            arrays[i] = parsed
+    return arrays
+
+def text2vector(text):
+    """
+    Compute the model features for an essay, parsing it sentence by sentence.
+
+    Every grading path (the tab, the API, text2pred_batch and train.py) splits essays
+    with split_sentences, so an essay gets the same features wherever it is scored.
+    Sentences graded before are not parsed again. Texts longer than STREAM_MIN_CHARS
+    skip the sentence cache and are reduced to running counts as they are parsed, so
+    memory does not grow with the text.
+
+    Args:
+        text (str): Input text.
+
+    Returns:
+        np.array: Feature values ordered like FEATURE_COLUMNS.
+    """
+    sentences = split_sentences(text)
+    if len(text) <= STREAM_MIN_CHARS:
+        return arrays2vector(concat_arrays(parse_sentences(sentences)))
+    # Sentences are counted in groups, as every FeatureCounter.add has a fixed numpy overhead
+    counter, group = FeatureCounter(), []
+    for doc in nlp.pipe(sentences, batch_size=256):
+        group.append(doc_arrays(doc))
+        if len(group) == COUNT_GROUP_SENTENCES:
+            counter.add(concat_arrays(group))
+            group = []
+    counter.add(concat_arrays(group))
+    return counter.vector()
+
+def _last_break(pattern, text):
+    end = None
+    for match in pattern.finditer(text):
+        end = match.end()
+    return end
+
+def split_chunks(text, max_chars=STREAM_CHUNK_CHARS):
+    """
+    Cut text into consecutive pieces of at most max_chars characters.
+
+    Each piece ends after the last paragraph break it contains, or else after the
+    last sentence break, or else at whitespace; only text without any whitespace is
+    cut mid-word.
+
+    Args:
+        text (str): Input text.
+        max_chars (int, optional): Longest piece. Defaults to STREAM_CHUNK_CHARS.
+
+    Yields:
+        str: Pieces of text that join back into the input.
+    """
+    start = 0
+    while len(text) - start > max_chars:
+        window = text[start:start + max_chars]
+        cut = (_last_break(PARAGRAPH_BREAK, window) or _last_break(SENTENCE_BREAK, window)
+               or _last_break(WHITESPACE, window) or max_chars)
+        yield window[:cut]
+        start += cut
+    if start < len(text):
+        yield text[start:]
+
+# Only the parts of the default plotly template a bar histogram uses; the per-trace-type
+# defaults make up most of the template and would otherwise ship with every figure.
+FIGURE_TEMPLATE = go.layout.Template(layout={
+    key: pio.templates["plotly"].layout[key]
+    for key in ("autotypenumbers", "colorway", "font", "hoverlabel", "hovermode", "title", "xaxis", "yaxis")
+})
+
+def build_base_figure(values, title, x_title, nbins=30):
+    """
+    Build a pre-binned histogram of the passing essays for one feature.
+
+    Args:
+        values (np.array): Feature values of essays that passed.
+        title (str): Figure title.
+        x_title (str): X axis title.
+        nbins (int, optional): Number of bins. Defaults to 30.
+
+    Returns:
+        dict: JSON-ready plotly figure.
+    """
+    density, edges = np.histogram(values, bins=nbins, density=True)
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=density, width=np.diff(edges),
+                           marker=dict(color='blue', line=dict(color='blue', width=1), opacity=0.5),
+                           hoverinfo='none'))
+    fig.update_layout(template=FIGURE_TEMPLATE, showlegend=False, plot_bgcolor='rgba(0,0,0,0)',
+                      paper_bgcolor='rgba(0,0,0,0)', bargap=0, title=title)
+    fig.update_xaxes(title_text=x_title, range=[0, max(values)])
+    fig.update_yaxes(title_text='Fraction of Students who Passed')
+    return json.loads(fig.to_json())
+
+def with_vline(base_fig, x):
+    """
+    Copy a base figure and mark a value on it with a red vertical line.
+
+    Args:
+        base_fig (dict): Figure from build_base_figure.
+        x (float): Position of the line.
+
+    Returns:
+        dict: New figure sharing the base figure's traces.
+    """
+    vline = {"type": "line", "x0": x, "x1": x, "xref": "x", "y0": 0, "y1": 1, "yref": "y domain",
+             "line": {"color": "red"}}
+    return {"data": base_fig["data"], "layout": {**base_fig["layout"], "shapes": [vline]}}
+
+def build_reference_index(english, imp):
+    """
+    Preprocess the reference distribution and importance table for fast ranking.
 
     Args:
-        pos_cols (pd.DataFrame): DataFrame with feature values.
         english (pd.DataFrame): English proficiency data.
         imp (pd.DataFrame): Importance data.
 
     Returns:
-        list: List of histogram figures.
-        list: List of top feature names.
-    """
-    percentiles = {}
-    for column in english.drop("test_score", axis=1).columns:
-        english_values = english[column].values
-        pos_col_value = pos_cols[column].values[0]
-        percentile = np.sum(english_values <= pos_col_value) / len(english_values)
-        percentiles[column] = percentile
-    # Create a new dataframe to store the percentiles
-    percentiles_df = pd.DataFrame(percentiles.items(), columns=['feature', 'percentile'])
-    merged_data = imp.merge(percentiles_df, on="feature", how="left")
-    merged_data['relative_importance'] = [(0 if perc >= 0.5 else (1-perc)/0.5) * purity if good else ((0.5-perc)/0.5)*purity for perc,
-                                          purity, good in zip(merged_data['percentile'], merged_data['IncNodePurity'],
-                                                              merged_data['good_feature'])]
-    sorted_data = merged_data.sort_values('relative_importance', ascending=False)
-    top_features = sorted_data.head(4)['feature'].tolist()
+        dict: Sorted reference values of all features in one offset array, importance
+        arrays aligned with imp, and a pre-binned base figure per feature.
+    """
+    columns = english.drop("test_score", axis=1).columns
+    column_position = {column: i for i, column in enumerate(columns)}
     passing_scores = english[english['test_score'] == 1]
-    figs = []
-    feature_names = [imp.loc[imp['feature'] == feature, 'feature_name'].iloc[0] for feature in top_features]
-    feature_titles = [imp.loc[imp['feature'] == feature, 'comment'].iloc[0] for feature in top_features]
-    for i, feature in enumerate(top_features):
-        fig = px.histogram(passing_scores, x=feature, nbins=30, histnorm='probability density')
-        fig.update_traces(marker=dict(color='blue', line=dict(color='blue', width=1)
-                                      , opacity=0.5), hoverinfo='none')
-        fig.update_layout(showlegend=False, plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', bargap=0)
-        fig.update_layout(title=feature_titles[i])
-        fig.add_vline(x=pos_cols[feature].iloc[0], line_color='red')
-        fig.update_xaxes(title_text=feature_names[i], range=[0, max(passing_scores[feature])])
-        fig.update_xaxes(title_text=feature_names[i])
-        fig.update_yaxes(title_text='Fraction of Students who Passed')
-        figs.append(fig)
-
-    return figs
+    names = dict(zip(imp["feature"], imp["feature_name"]))
+    comments = dict(zip(imp["feature"], imp["comment"]))
+    # Column j is shifted by j * stride so one searchsorted ranks every feature at once;
+    # essay values are clipped to just outside their column's range to stay in its band.
+    values = english[columns].to_numpy(dtype=float)
+    low, high = values.min(axis=0) - 1, values.max(axis=0) + 1
+    stride = float(np.max(high - low)) + 1
+    offsets = (np.arange(len(columns)) * stride - low)
+    return {
+        "english": english,
+        "columns": columns,
+        "column_position": column_position,
+        "sorted_values": (np.sort(values, axis=0) + offsets).T.ravel(),
+        "n_reference": len(values),
+        "bounds": (low, high),
+        "offsets": offsets,
+        "features": imp["feature"].values,
+        "positions": np.array([column_position[feature] for feature in imp["feature"]]),
+        "purity": imp["IncNodePurity"].values.astype(float),
+        "good": imp["good_feature"].values.astype(bool),
+        "names": names,
+        "comments": comments,
+        "figures": {feature: build_base_figure(passing_scores[feature].values, comments[feature], names[feature])
+                    for feature in imp["feature"]},
+    }
+
+
+REFERENCE_INDEX = build_reference_index(english, imp)
+
+
+def rank_features(values, index, top_n=4):
+    """
+    Rank features by how much improving them would help the essay.
+
+    Args:
+        values (np.array): Essay feature values ordered like index["columns"].
+        index (dict): Output of build_reference_index.
+        top_n (int, optional): Number of features to return. Defaults to 4.
+
+    Returns:
+        list: Names of the top_n features, most helpful first.
+    """
+    n = index["n_reference"]
+    keys = np.clip(values, *index["bounds"]) + index["offsets"]
+    ranks = np.searchsorted(index["sorted_values"], keys, side="right") - np.arange(len(keys)) * n
+    percentile = (ranks / n)[index["positions"]]
+    purity = index["purity"]
+    relative_importance = np.where(index["good"],
+                                   np.where(percentile >= 0.5, 0, (1 - percentile) / 0.5) * purity,
+                                   ((0.5 - percentile) / 0.5) * purity)
+    order = np.argsort(-relative_importance, kind="stable")
+    return index["features"][order[:top_n]].tolist()
+
+def get_figs(values, english):
+    """
+    Generate histograms with vertical lines for top features.
+
+    Args:
+        values (np.array): Essay feature values ordered like FEATURE_COLUMNS.
+        english (pd.DataFrame): English proficiency data.
+
+    Returns:
+        list: List of histogram figures (plotly figure dicts).
+    """
+    index = REFERENCE_INDEX if english is REFERENCE_INDEX["english"] else build_reference_index(english, imp)
+    values = np.asarray(values, dtype=float)
+    top_features = rank_features(values, index)
+    return [with_vline(index["figures"][feature], float(values[index["column_position"][feature]]))
+            for feature in top_features]
@@ -0,0 +1,155 @@
+"""Flattened, array-based evaluator for the fitted random forest.
+
+sklearn's predict spends most of its time on input validation and joblib dispatch
+when scoring a single 1x12 row. flatten_forest copies every tree into shared
+contiguous node arrays once, and predict walks all trees together with numpy.
+
+Run from src/ to check parity with sklearn and time single-row prediction:
+    python -m english_proficiency_r.forest
+"""
+
+import time
+import warnings
+
+import numpy as np
+
+
+def _floor_float32(thresholds):
+    """
+    Round float64 split thresholds down to float32.
+
+    sklearn compares float32 inputs against float64 thresholds. Rounding down keeps
+    x <= threshold exact for every float32 x, so float32 storage gives identical splits.
+    """
+    rounded = thresholds.astype(np.float32)
+    too_high = rounded.astype(np.float64) > thresholds
+    rounded[too_high] = np.nextafter(rounded[too_high], np.float32(-np.inf))
+    return rounded
+
+
+def flatten_forest(rf):
+    """
+    Export a fitted forest into contiguous node arrays.
+
+    Leaves point back at themselves with an infinite threshold, so every tree can be
+    walked for max_depth steps without checking which ones already reached a leaf.
+    children holds the left and right child of node i at 2 * i and 2 * i + 1.
+
+    Args:
+        rf (RandomForestRegressor): Fitted single-output forest.
+
+    Returns:
+        dict: Node arrays ("feature", "threshold", "children", "value"), the root node of
+        each tree ("roots"), the deepest tree's depth and the training feature names.
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    for estimator in rf.estimators_:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left == -1
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+        lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+        rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+        values.append(tree.value[:, 0, 0])
+        roots.append(offset)
+        offset += tree.node_count
+
+    return {
+        "feature": np.ascontiguousarray(np.concatenate(features), dtype=np.int32),
+        "threshold": _floor_float32(np.concatenate(thresholds)),
+        "children": np.ascontiguousarray(np.stack([np.concatenate(lefts), np.concatenate(rights)], axis=1),
+                                         dtype=np.int32).reshape(-1),
+        "value": np.ascontiguousarray(np.concatenate(values), dtype=np.float32),
+        "left_slots": np.arange(0, 2 * offset, 2, dtype=np.int32),
+        "roots": np.array(roots, dtype=np.int32),
+        "max_depth": max(estimator.tree_.max_depth for estimator in rf.estimators_),
+        "feature_names": list(getattr(rf, "feature_names_in_", [])),
+    }
+
+
+def predict(flat, X):
+    """
+    Average the leaf values of all trees for each row.
+
+    For a single row every split of every tree is evaluated at once, which turns the
+    tree walk into max_depth pointer lookups shared by all trees. Larger inputs walk
+    all trees of all rows level by level.
+
+    Args:
+        flat (dict): Output of flatten_forest.
+        X (np.array): Feature matrix (n_rows x n_features) or a single row.
+
+    Returns:
+        np.array: One prediction per row.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    feature, threshold, children = flat["feature"], flat["threshold"], flat["children"]
+    nodes = flat["roots"]
+    if X.ndim == 1 or len(X) == 1:
+        next_node = children[flat["left_slots"] + (X.reshape(-1)[feature] > threshold)]
+        for _ in range(flat["max_depth"]):
+            nodes = next_node[nodes]
+        return np.array([flat["value"][nodes].mean(dtype=np.float64)])
+
+    rows = np.arange(len(X))[:, None]
+    nodes = np.broadcast_to(nodes, (len(X), len(nodes)))
+    for _ in range(flat["max_depth"]):
+        nodes = children[2 * nodes + (X[rows, feature[nodes]] > threshold[nodes])]
+    return flat["value"][nodes].mean(axis=1, dtype=np.float64)
+
+
+def _best_of(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check_parity(rf, X, atol=1e-5):
+    """
+    Compare predict against sklearn on X, through both the batch and single-row paths.
+
+    Returns:
+        float: Largest absolute difference. Raises AssertionError above atol.
+    """
+    flat = flatten_forest(rf)
+    expected = rf.predict(X)
+    X = np.asarray(X)
+    single = np.concatenate([predict(flat, row) for row in X])
+    diff = float(max(np.max(np.abs(predict(flat, X) - expected)), np.max(np.abs(single - expected))))
+    assert diff <= atol, f"flattened forest differs from sklearn by {diff}"
+    return diff
+
+
+def main():
+    import pandas as pd
+    from . import model_registry
+
+    warnings.simplefilter("ignore", UserWarning)
+    english = pd.read_csv(model_registry.artifact_path("reference"))
+    X = english.drop("test_score", axis=1)
+    rf = model_registry.load_model(english)
+
+    rng = np.random.default_rng(0)
+    perturbed = X.sample(2000, replace=True, random_state=0) * rng.uniform(0.5, 1.5, size=(2000, X.shape[1]))
+    samples = pd.concat([X, perturbed.round(), perturbed], ignore_index=True)
+    print(f"parity: max |diff| = {check_parity(rf, samples):.2e} over {len(samples)} rows")
+
+    flat = flatten_forest(rf)
+    row_df = X.iloc[[0]]
+    row = row_df.to_numpy()
+    sklearn_us = _best_of(lambda: rf.predict(row_df), 50) * 1e6
+    flat_us = _best_of(lambda: predict(flat, row), 500) * 1e6
+    print(f"single row: sklearn {sklearn_us:.0f} us, flattened {flat_us:.1f} us")
+    batch = samples.to_numpy()
+    print(f"1 row via the batch path: {_best_of(lambda: predict(flat, batch[:2]), 500) / 2 * 1e6:.1f} us/row")
+    print(f"{len(batch)} rows: sklearn {_best_of(lambda: rf.predict(samples), 5) * 1e3:.1f} ms, "
+          f"flattened {_best_of(lambda: predict(flat, batch), 5) * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
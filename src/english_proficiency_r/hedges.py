@@ -0,0 +1,150 @@
+"""Compiled multi-word matcher for the hedge/booster lexicon in hedges_boosters.yml."""
+
+import os
+import pickle
+import threading
+
+import spacy
+import yaml
+from spacy.attrs import LOWER
+
+from .model_registry import file_sha256
+
+LEXICON_PATH = "english_proficiency_r/hedges_boosters.yml"
+CACHE_PATH = "english_proficiency_r/hedges_boosters.pkl"
+CATEGORIES = ("ConfidenceHedged", "ConfidenceHigh")
+
+# Key under which a trie node stores the category index of a phrase ending there.
+# Token keys are LOWER string hashes, which are never negative.
+_END = -1
+
+
+def compile_lexicon(nlp, lexicon):
+    """
+    Compile the lexicon into a token trie keyed by lowercase string hashes.
+
+    Phrases are tokenized with the pipeline's own tokenizer so they line up with
+    the tokens of a parsed essay.
+
+    Args:
+        nlp (spacy.Language): Pipeline whose tokenizer is used.
+        lexicon (dict): Mapping of category name to list of phrases.
+
+    Returns:
+        dict: Nested dicts from token hash to child node; phrase ends carry the category index.
+    """
+    trie = {}
+    for category_index, category in enumerate(CATEGORIES):
+        phrases = lexicon.get(category) or []
+        for doc in nlp.tokenizer.pipe(phrases):
+            node = trie
+            for key in doc.to_array(LOWER).tolist():
+                node = node.setdefault(key, {})
+            if len(doc):
+                node[_END] = category_index
+    return trie
+
+
+def load_matcher(nlp):
+    """
+    Load the compiled lexicon from its binary cache, rebuilding it if the YAML changed.
+
+    Args:
+        nlp (spacy.Language): Pipeline whose tokenizer is used when compiling.
+
+    Returns:
+        dict: Compiled token trie (see compile_lexicon).
+    """
+    source_sha256 = file_sha256(LEXICON_PATH)
+    try:
+        with open(CACHE_PATH, 'rb') as file:
+            cached = pickle.load(file)
+        if cached["source_sha256"] == source_sha256 and cached["spacy_version"] == spacy.__version__:
+            return cached["trie"]
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass
+
+    with open(LEXICON_PATH) as file:
+        lexicon = yaml.load(file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    trie = compile_lexicon(nlp, lexicon)
+    # Worker processes starting together may all write the cache; each uses its own temp file
+    tmp_path = f"{CACHE_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as file:
+            pickle.dump({"source_sha256": source_sha256, "spacy_version": spacy.__version__, "trie": trie},
+                        file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, CACHE_PATH)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return trie
+
+
+def max_phrase_length(trie):
+    """
+    Length in tokens of the longest phrase in a compiled lexicon.
+
+    Args:
+        trie (dict): Compiled lexicon from load_matcher.
+
+    Returns:
+        int: Number of tokens.
+    """
+    children = [node for key, node in trie.items() if key != _END]
+    return 1 + max(map(max_phrase_length, children)) if children else 0
+
+
+def scan_phrases(trie, keys, stop=None):
+    """
+    Count lexicon phrases in a token sequence in one left-to-right pass.
+
+    At each position the longest matching phrase wins and matching resumes after it,
+    so overlapping entries like "a certain level" / "a certain level of" count once.
+
+    Args:
+        trie (dict): Compiled lexicon from load_matcher.
+        keys (list): LOWER hashes of the tokens, in document order.
+        stop (int, optional): Don't start matches at or after this position. Defaults to len(keys).
+
+    Returns:
+        tuple: Number of matches per category (ordered like CATEGORIES), and the position
+        where scanning stopped, from which it can continue once more tokens are known.
+    """
+    counts = [0] * len(CATEGORIES)
+    n = len(keys)
+    stop = n if stop is None else stop
+    i = 0
+    while i < stop:
+        node = trie.get(keys[i])
+        if node is None:
+            i += 1
+            continue
+        match_end, match_category = None, None
+        j = i
+        while node is not None:
+            j += 1
+            if _END in node:
+                match_end, match_category = j, node[_END]
+            node = node.get(keys[j]) if j < n else None
+        if match_end is None:
+            i += 1
+        else:
+            counts[match_category] += 1
+            i = match_end
+    return counts, i
+
+
+def count_phrases(trie, keys):
+    """
+    Count lexicon phrases in a whole token sequence (see scan_phrases).
+
+    Args:
+        trie (dict): Compiled lexicon from load_matcher.
+        keys (list): LOWER hashes of the tokens, in document order.
+
+    Returns:
+        list: Number of matches per category, ordered like CATEGORIES.
+    """
+    return scan_phrases(trie, keys)[0]
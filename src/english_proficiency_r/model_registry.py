@@ -0,0 +1,257 @@
+"""Versioned, checksum-verified storage for the TOEFL grading model."""
+
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+
+ARTIFACT_DIR = "english_proficiency_r"
+MANIFEST_PATH = os.path.join(ARTIFACT_DIR, "model_manifest.json")
+# Artifact paths (relative to ARTIFACT_DIR) used when there is no manifest yet
+DEFAULT_FILES = {
+    "model": {"path": "random_forest_model.pkl"},
+    "reference": {"path": "english_results_subset.csv"},
+    "importance": {"path": "rf_importance.csv"},
+}
+
+
+def file_sha256(path):
+    """
+    Compute the sha256 checksum of a file.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        str: Hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest():
+    """
+    Read the artifact manifest.
+
+    Returns:
+        dict: Manifest contents, or None if there is no manifest.
+    """
+    try:
+        with open(MANIFEST_PATH) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(manifest):
+    """
+    Atomically replace the artifact manifest.
+
+    Args:
+        manifest (dict): Manifest contents.
+    """
+    tmp_path = _tmp_path(MANIFEST_PATH)
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+        file.write("\n")
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _tmp_path(path):
+    # Worker processes can refit and publish at the same time; each writes its own temp file
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def artifact_path(name, manifest=None):
+    """
+    Resolve the path of a named artifact ("model", "reference" or "importance").
+
+    Args:
+        name (str): Artifact name as listed in the manifest.
+        manifest (dict, optional): Manifest to read from. Loaded from disk if omitted.
+
+    Returns:
+        str: Path of the artifact relative to the working directory.
+    """
+    files = (manifest or load_manifest() or {"files": DEFAULT_FILES})["files"]
+    return os.path.join(ARTIFACT_DIR, files[name]["path"])
+
+
+def is_stale(manifest):
+    """
+    Check whether the stored model is missing, corrupt, was fit on other data, or was
+    pickled by another scikit-learn version.
+
+    Args:
+        manifest (dict): Manifest contents, or None.
+
+    Returns:
+        bool: True if the model has to be refit.
+    """
+    import sklearn
+
+    if manifest is None:
+        return True
+    return manifest.get("sklearn_version") != sklearn.__version__ or not files_intact(manifest)
+
+
+def files_intact(manifest):
+    """
+    Check that the model and reference data listed in a manifest exist with their recorded checksums.
+
+    Args:
+        manifest (dict): Manifest contents.
+
+    Returns:
+        bool: True if both files match the manifest.
+    """
+    for name in ("model", "reference"):
+        entry = manifest["files"][name]
+        path = os.path.join(ARTIFACT_DIR, entry["path"])
+        if not os.path.exists(path) or file_sha256(path) != entry["sha256"]:
+            return False
+    return True
+
+
+def fit_model(english, **params):
+    """
+    Fit the grading forest on the reference data.
+
+    Args:
+        english (pd.DataFrame): Reference features with a test_score column.
+        **params: Extra RandomForestRegressor parameters.
+
+    Returns:
+        RandomForestRegressor: Fitted model.
+    """
+    from sklearn.ensemble import RandomForestRegressor
+
+    rf = RandomForestRegressor(**{"random_state": 42, **params})
+    rf.fit(english.drop("test_score", axis=1), english["test_score"])
+    return rf
+
+
+def _dump_model(rf, path):
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(rf, file)
+    os.replace(tmp_path, path)
+
+
+def _publish(files, manifest, **extra):
+    """Checksum the artifacts in files and write them as the next manifest version."""
+    import sklearn
+
+    checksummed = {}
+    for name, entry in files.items():
+        path = os.path.join(ARTIFACT_DIR, entry["path"])
+        checksummed[name] = {"path": entry["path"], "sha256": file_sha256(path) if os.path.exists(path) else None}
+    new_manifest = {
+        "version": next_version(manifest),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "sklearn_version": sklearn.__version__,
+        "files": checksummed,
+        **extra,
+    }
+    write_manifest(new_manifest)
+    return new_manifest
+
+
+def next_version(manifest):
+    """Version number the next published artifact set gets."""
+    return (manifest["version"] + 1) if manifest else 1
+
+
+def save_model(rf, manifest=None):
+    """
+    Write a refit model next to its reference data and bump the manifest version.
+
+    Args:
+        rf (RandomForestRegressor): Fitted model.
+        manifest (dict, optional): Current manifest, used to carry over the other artifacts.
+
+    Returns:
+        dict: The new manifest.
+    """
+    files = dict(manifest["files"]) if manifest else dict(DEFAULT_FILES)
+    _dump_model(rf, os.path.join(ARTIFACT_DIR, files["model"]["path"]))
+    return _publish(files, manifest)
+
+
+def save_artifact_set(directory, rf, reference, importance, manifest=None, **extra):
+    """
+    Write a model, its reference data and its importance table as one new artifact set.
+
+    The files go to their own directory, and the manifest switches over to them only
+    once all of them are written.
+
+    Args:
+        directory (str): Directory for the set, relative to ARTIFACT_DIR.
+        rf (RandomForestRegressor): Fitted model.
+        reference (pd.DataFrame): Reference features with a test_score column.
+        importance (pd.DataFrame): Importance table in the rf_importance.csv format.
+        manifest (dict, optional): Current manifest, used for the version number.
+        **extra: Additional manifest fields, e.g. a description of the training run.
+
+    Returns:
+        dict: The new manifest.
+    """
+    os.makedirs(os.path.join(ARTIFACT_DIR, directory), exist_ok=True)
+    files = {name: {"path": os.path.join(directory, entry["path"])} for name, entry in DEFAULT_FILES.items()}
+    _dump_model(rf, os.path.join(ARTIFACT_DIR, files["model"]["path"]))
+    reference.to_csv(os.path.join(ARTIFACT_DIR, files["reference"]["path"]), index=False)
+    importance.to_csv(os.path.join(ARTIFACT_DIR, files["importance"]["path"]), index=False)
+    return _publish(files, manifest, **extra)
+
+
+def load_model(english):
+    """
+    Load the grading model once, refitting only if the stored artifact is missing or stale.
+
+    A model trained by train.py is never replaced by a refit on the reference sample:
+    if it is stale it is still used when its files are intact and it can be unpickled
+    (otherwise a refit is used in memory only), and a message asks for it to be retrained.
+
+    Args:
+        english (pd.DataFrame): Reference features used if the model has to be refit.
+
+    Returns:
+        RandomForestRegressor: Model ready for inference.
+    """
+    import sklearn
+
+    manifest = load_manifest()
+    stale = is_stale(manifest)
+    trained = bool(manifest and manifest.get("training"))
+    if stale and trained:
+        print(f"Model v{manifest['version']} (pickled with scikit-learn {manifest.get('sklearn_version')}, "
+              f"running {sklearn.__version__}) is stale; rerun english_proficiency_r.train to replace it",
+              file=sys.stderr)
+    elif manifest and manifest.get("sklearn_version") != sklearn.__version__:
+        print(f"Model was pickled with scikit-learn {manifest.get('sklearn_version')}, "
+              f"running {sklearn.__version__}; refitting", file=sys.stderr)
+    if not stale or (trained and files_intact(manifest)):
+        try:
+            with open(artifact_path("model", manifest), 'rb') as file:
+                return pickle.load(file)
+        except (OSError, pickle.UnpicklingError, AttributeError, EOFError, ImportError):
+            pass
+    rf = fit_model(english)
+    if trained:
+        return rf
+    latest = load_manifest()
+    if latest != manifest and not is_stale(latest):
+        # Another worker process refit and published while this one was fitting
+        return rf
+    try:
+        save_model(rf, manifest)
+    except OSError:
+        # Read-only deploys still get a working (in-memory) model
+        pass
+    return rf
@@ -0,0 +1,90 @@
+"""Compare spaCy pipeline profiles on startup time, per-essay latency and predictions.
+
+Run from src/:  python -m english_proficiency_r.profiles [essay.txt ...]
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import english_proficiency as ep
+
+
+def profile_report(profile, texts, repeats=3):
+    """
+    Measure one pipeline profile.
+
+    Args:
+        profile (str): Name in ep.PIPELINE_PROFILES.
+        texts (list): Essays to grade.
+        repeats (int, optional): Timed passes over the essays. Defaults to 3.
+
+    Returns:
+        dict: Load time, pipeline components, median per-essay latency and feature matrix.
+    """
+    start = time.perf_counter()
+    pipeline = ep.load_pipeline(profile)
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(repeats):
+        for text in texts:
+            start = time.perf_counter()
+            ep.doc2vector(pipeline(text))
+            latencies.append(time.perf_counter() - start)
+
+    features = np.array([ep.doc2vector(pipeline(text)) for text in texts])
+    return {
+        "profile": profile,
+        "components": pipeline.pipe_names,
+        "load_seconds": load_seconds,
+        "median_essay_ms": statistics.median(latencies) * 1000,
+        "features": features,
+        "scores": ep.predict_scores(pd.DataFrame(features, columns=ep.FEATURE_COLUMNS)),
+    }
+
+
+def compare_profiles(texts, profiles=("full", "grading"), repeats=3):
+    """
+    Compare pipeline profiles against the first one listed.
+
+    Args:
+        texts (list): Essays to grade.
+        profiles (tuple, optional): Profiles to compare. Defaults to ("full", "grading").
+        repeats (int, optional): Timed passes over the essays. Defaults to 3.
+
+    Returns:
+        list: One report dict per profile, with "same_features" and "max_score_diff"
+        measured against the first profile.
+    """
+    reports = [profile_report(profile, texts, repeats) for profile in profiles]
+    baseline = reports[0]
+    for report in reports:
+        report["same_features"] = bool(np.allclose(report["features"], baseline["features"]))
+        report["max_score_diff"] = float(np.max(np.abs(report["scores"] - baseline["scores"])))
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("essays", nargs="*", help="Essay text files (defaults to the example submission)")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = args.essays or ["english_proficiency_r/example_submission.txt"]
+    texts = []
+    for path in paths:
+        with open(path) as file:
+            texts.append(file.read())
+
+    for report in compare_profiles(texts, tuple(ep.PIPELINE_PROFILES), args.repeats):
+        print(f"{report['profile']:>8}: load {report['load_seconds']:.2f}s, "
+              f"{report['median_essay_ms']:.1f} ms/essay, components={report['components']}, "
+              f"same features={report['same_features']}, max score diff={report['max_score_diff']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
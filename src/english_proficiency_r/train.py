@@ -0,0 +1,216 @@
+"""Train the grading forest on a raw essay corpus and publish it as a new artifact set.
+
+The corpus is streamed from a JSONL file ({"text": ..., "test_score": ...} per line)
+or a CSV file with the same columns. Features are extracted in chunks with the same
+code that grades essays, parsing each chunk with nlp.pipe over several processes.
+Every finished chunk is saved, so an interrupted run picks up where it stopped.
+Then the forest is fit on all rows, and the model, its importance table and a
+reference sample are written to models/v<N>/ and published in the manifest.
+
+Run from src/:
+    python -m english_proficiency_r.train corpus.jsonl --processes 4
+"""
+
+import argparse
+import csv
+import glob
+import itertools
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from . import english_proficiency as ep
+from . import model_registry
+
+
+def read_corpus(path, text_column="text", label_column="test_score"):
+    """
+    Stream (text, label) pairs from a JSONL or CSV corpus.
+
+    Rows without a text or a numeric label are yielded as (None, None), so that row
+    numbers stay stable between runs.
+
+    Args:
+        path (str): Corpus file; ".jsonl"/".ndjson" files are read as JSON lines, anything else as CSV.
+        text_column (str, optional): Field holding the essay. Defaults to "text".
+        label_column (str, optional): Field holding the score. Defaults to "test_score".
+
+    Yields:
+        tuple: (text, label) per row.
+    """
+    with open(path, newline="") as file:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows = (json.loads(line) if line.strip() else {} for line in file)
+        else:
+            rows = csv.DictReader(file)
+        for row in rows:
+            text = row.get(text_column)
+            try:
+                label = float(row.get(label_column))
+            except (TypeError, ValueError):
+                label = None
+            if not isinstance(text, str) or not text.strip() or label is None:
+                yield None, None
+            else:
+                yield text, label
+
+
+def extract_chunk(pairs, processes=1, batch_size=256):
+    """
+    Compute features for one chunk of (text, label) pairs, skipping invalid rows.
+
+    Returns:
+        pd.DataFrame: FEATURE_COLUMNS plus test_score, one row per valid pair.
+    """
+    valid = [(text, label) for text, label in pairs if text is not None]
+    if not valid:
+        return pd.DataFrame(columns=[*ep.FEATURE_COLUMNS, "test_score"])
+    texts, labels = zip(*valid)
+    features = ep.text2pred_batch(texts, batch_size=batch_size, n_process=processes)
+    features = features.drop(columns="score")
+    features["test_score"] = labels
+    return features
+
+
+def _checkpoint_info(corpus, chunk_size):
+    stat = os.stat(corpus)
+    return {"corpus": os.path.abspath(corpus), "size": stat.st_size, "mtime": stat.st_mtime,
+            "chunk_size": chunk_size, "pipeline_profile": ep.PIPELINE_PROFILE,
+            "feature_columns": list(ep.FEATURE_COLUMNS),
+            # Chunks saved before essays were parsed sentence by sentence have other features
+            "extraction": "sentences"}
+
+
+def extract_features(corpus, checkpoint_dir, chunk_size=500, processes=1, restart=False, **columns):
+    """
+    Extract features for the whole corpus, saving each chunk under checkpoint_dir.
+
+    Chunks already saved by an earlier run on the same corpus, chunk size and pipeline
+    are read back instead of being parsed again.
+
+    Args:
+        corpus (str): Corpus file (see read_corpus).
+        checkpoint_dir (str): Directory for the chunk files.
+        chunk_size (int, optional): Corpus rows per chunk. Defaults to 500.
+        processes (int, optional): Parsing processes. Defaults to 1.
+        restart (bool, optional): Discard chunks from an earlier run. Defaults to False.
+        **columns: text_column / label_column for read_corpus.
+
+    Returns:
+        pd.DataFrame: Features and test_score of every valid corpus row.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    info_path = os.path.join(checkpoint_dir, "checkpoint.json")
+    info = _checkpoint_info(corpus, chunk_size)
+    saved = None
+    if os.path.exists(info_path):
+        with open(info_path) as file:
+            saved = json.load(file)
+    if restart or saved != info:
+        if saved is not None and not restart:
+            print("Corpus, chunk size or pipeline changed; starting over", file=sys.stderr)
+        for path in glob.glob(os.path.join(checkpoint_dir, "chunk_*.csv")):
+            os.remove(path)
+        with open(info_path, 'w') as file:
+            json.dump(info, file, indent=2)
+
+    chunks, rows_done, start = [], 0, time.perf_counter()
+    pairs = read_corpus(corpus, **columns)
+    for index in itertools.count():
+        chunk = list(itertools.islice(pairs, chunk_size))
+        if not chunk:
+            break
+        path = os.path.join(checkpoint_dir, f"chunk_{index:06d}.csv")
+        if os.path.exists(path):
+            features = pd.read_csv(path)
+        else:
+            features = extract_chunk(chunk, processes)
+            features.to_csv(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+        chunks.append(features)
+        rows_done += len(chunk)
+        print(f"chunk {index}: {rows_done} rows read, {sum(map(len, chunks))} usable, "
+              f"{time.perf_counter() - start:.0f}s", file=sys.stderr)
+
+    if not chunks:
+        raise ValueError(f"{corpus} has no rows")
+    return pd.concat(chunks, ignore_index=True)
+
+
+def importance_table(rf, current):
+    """
+    Build an importance table for a new forest, keeping the hand-written labels of the current one.
+
+    Args:
+        rf (RandomForestRegressor): Fitted model.
+        current (pd.DataFrame): Current rf_importance.csv contents.
+
+    Returns:
+        pd.DataFrame: Table in the rf_importance.csv format, most important feature first.
+    """
+    importance = pd.DataFrame({"feature": rf.feature_names_in_, "IncNodePurity": rf.feature_importances_})
+    labels = current.drop(columns="IncNodePurity")
+    importance = importance.merge(labels, on="feature", how="left")
+    importance["feature_name"] = importance["feature_name"].fillna(importance["feature"])
+    importance["comment"] = importance["comment"].fillna("")
+    importance["good_feature"] = importance["good_feature"].fillna(True)
+    return importance.sort_values("IncNodePurity", ascending=False)[list(current.columns)]
+
+
+def train(corpus, chunk_size=500, processes=1, reference_rows=2000, n_estimators=100,
+          restart=False, **columns):
+    """
+    Extract features, fit the forest and publish the new artifact set.
+
+    Args:
+        corpus (str): Corpus file (see read_corpus).
+        chunk_size (int, optional): Corpus rows per checkpointed chunk. Defaults to 500.
+        processes (int, optional): Parsing processes. Defaults to 1.
+        reference_rows (int, optional): Rows sampled for the reference distribution
+            shown next to each grade. Defaults to 2000.
+        n_estimators (int, optional): Trees in the forest. Defaults to 100.
+        restart (bool, optional): Ignore checkpoints from an earlier run. Defaults to False.
+        **columns: text_column / label_column for read_corpus.
+
+    Returns:
+        dict: The new manifest.
+    """
+    manifest = model_registry.load_manifest()
+    directory = os.path.join("models", f"v{model_registry.next_version(manifest)}")
+    checkpoint_dir = os.path.join(model_registry.ARTIFACT_DIR, directory, "features")
+    features = extract_features(corpus, checkpoint_dir, chunk_size, processes, restart, **columns)
+    features = features[[*ep.FEATURE_COLUMNS, "test_score"]]
+
+    rf = model_registry.fit_model(features, n_estimators=n_estimators, oob_score=True, n_jobs=processes)
+    reference = features.sample(min(reference_rows, len(features)), random_state=42)
+    manifest = model_registry.save_artifact_set(
+        directory, rf, reference, importance_table(rf, ep.imp), manifest,
+        training={"corpus": os.path.abspath(corpus), "rows": len(features), "n_estimators": n_estimators,
+                  "oob_score": float(rf.oob_score_), "pipeline_profile": ep.PIPELINE_PROFILE})
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", help="JSONL or CSV file with an essay and a score per row")
+    parser.add_argument("--processes", type=int, default=1, help="Parsing (and fitting) processes")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Corpus rows per checkpoint")
+    parser.add_argument("--reference-rows", type=int, default=2000)
+    parser.add_argument("--trees", type=int, default=100)
+    parser.add_argument("--text-column", default="text")
+    parser.add_argument("--label-column", default="test_score")
+    parser.add_argument("--restart", action="store_true", help="Ignore checkpoints from an earlier run")
+    args = parser.parse_args()
+
+    manifest = train(args.corpus, args.chunk_size, args.processes, args.reference_rows, args.trees,
+                     args.restart, text_column=args.text_column, label_column=args.label_column)
+    training = manifest["training"]
+    print(f"Published model v{manifest['version']} ({model_registry.artifact_path('model', manifest)}): "
+          f"{training['rows']} essays, OOB R^2 {training['oob_score']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Pool of long-lived grading processes, so concurrent gradings don't contend on the GIL.
+
+Each worker process imports english_proficiency once (spaCy pipeline, hedge matcher,
+forest) and then grades essays, or batches of essays, sent to it over a pipe. The pool bounds how many
+requests may wait, enforces a per-request timeout, and replaces workers that crash
+or time out.
+"""
+
+import atexit
+import multiprocessing
+import queue
+import threading
+import time
+
+
+class PoolBusy(RuntimeError):
+    """Raised when more requests are waiting than the pool allows."""
+
+
+class WorkerCrashed(RuntimeError):
+    """Raised when a worker process died while grading."""
+
+
+def _worker_main(conn):
+    from . import english_proficiency as ep
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            return
+        if request is None:
+            return
+        kind, payload = request
+        try:
+            if kind == "batch":
+                reply = ("ok", ep.text2pred_batch(payload).to_dict(orient="records"))
+            else:
+                reply = ("ok", ep.grade_result(payload))
+        except Exception as error:
+            reply = ("error", f"{type(error).__name__}: {error}")
+        conn.send(reply)
+
+
+class _Worker:
+    def __init__(self, context):
+        self._context = context
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = self._context.Pipe()
+        self.process = self._context.Process(target=_worker_main, args=(child_conn,), daemon=True,
+                                             name="grading-worker")
+        self.process.start()
+        child_conn.close()
+
+    def restart(self):
+        self.stop(timeout=0)
+        self.start()
+
+    def stop(self, timeout=5):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1)
+        self.conn.close()
+
+
+class GradingPool:
+    """
+    Dispatch grading requests to warm worker processes.
+
+    Args:
+        processes (int): Number of worker processes.
+        max_pending (int, optional): Requests allowed to wait for a free worker before
+            PoolBusy is raised. Defaults to 8.
+        timeout (float, optional): Seconds a request may take, waiting included. Defaults to 60.
+    """
+
+    def __init__(self, processes, max_pending=8, timeout=60):
+        self.timeout = timeout
+        # spawn, not fork: the web process runs threads, which fork does not copy safely
+        context = multiprocessing.get_context("spawn")
+        self._workers = [_Worker(context) for _ in range(processes)]
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+        self._slots = threading.BoundedSemaphore(processes + max_pending)
+        self.restarts = 0
+        atexit.register(self.close)
+
+    def grade(self, text, timeout=None):
+        """
+        Grade an essay in a worker process.
+
+        Args:
+            text (str): Essay to grade.
+            timeout (float, optional): Overrides the pool's timeout for this request.
+
+        Returns:
+            dict: english_proficiency.grade_result output.
+
+        Raises:
+            PoolBusy: Too many requests are already waiting.
+            TimeoutError: No worker became free, or grading took too long (the worker is replaced).
+            WorkerCrashed: The worker died while grading (it is replaced).
+        """
+        return self._run(("grade", text), timeout)
+
+    def grade_batch(self, texts, timeout=None):
+        """
+        Grade several essays in one worker process, taking a single slot of the pool.
+
+        Args:
+            texts (list of str): Essays to grade.
+            timeout (float, optional): Overrides the pool's timeout for this request.
+
+        Returns:
+            list: english_proficiency.text2pred_batch rows as dicts (features and "score").
+
+        Raises:
+            PoolBusy, TimeoutError, WorkerCrashed: As for grade.
+        """
+        return self._run(("batch", list(texts)), timeout)
+
+    def _run(self, request, timeout):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusy("all grading workers are busy")
+        try:
+            try:
+                worker = self._idle.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise TimeoutError("no grading worker became free in time")
+            try:
+                status, payload = self._call(worker, request, deadline)
+            finally:
+                self._idle.put(worker)
+        finally:
+            self._slots.release()
+        if status != "ok":
+            raise RuntimeError(payload)
+        return payload
+
+    def _call(self, worker, request, deadline):
+        if not worker.process.is_alive():
+            self._replace(worker)
+        try:
+            worker.conn.send(request)
+            if worker.conn.poll(max(0, deadline - time.monotonic())):
+                return worker.conn.recv()
+        except (EOFError, OSError):
+            self._replace(worker)
+            raise WorkerCrashed("grading worker died")
+        self._replace(worker)
+        raise TimeoutError("grading took too long")
+
+    def _replace(self, worker):
+        self.restarts += 1
+        worker.restart()
+
+    def close(self):
+        """Stop all worker processes."""
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
@@ -0,0 +1,85 @@
+"""Local background job queue for slow callbacks.
+
+Dash callbacks submit work here and return immediately; the page then polls for
+the result with a dcc.Interval. Jobs live in this process's memory, which works
+because the app runs as a single gunicorn worker (see Procfile).
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+UNKNOWN = "unknown"
+
+
+class JobQueue:
+    """
+    Run callables on a worker pool and keep their results until fetched.
+
+    Finished results nobody fetched are dropped result_ttl seconds after the job finished.
+    """
+
+    def __init__(self, max_workers=2, result_ttl=600, name="job"):
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._jobs = {}  # job id -> future
+        self._finished_at = {}  # job id -> time the job finished
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs).
+
+        Returns:
+            str: Job id to poll with status() and collect with pop_result().
+        """
+        self._expire()
+        job_id = uuid.uuid4().hex
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._jobs[job_id] = future
+        future.add_done_callback(lambda _: self._finished(job_id))
+        return job_id
+
+    def _finished(self, job_id):
+        with self._lock:
+            if job_id in self._jobs:
+                self._finished_at[job_id] = time.time()
+
+    def status(self, job_id):
+        """Return PENDING, RUNNING, DONE, FAILED, or UNKNOWN for ids that expired or were fetched."""
+        with self._lock:
+            future = self._jobs.get(job_id)
+        if future is None:
+            return UNKNOWN
+        if not future.done():
+            return RUNNING if future.running() else PENDING
+        return FAILED if future.exception() is not None else DONE
+
+    def pop_result(self, job_id):
+        """
+        Remove a finished job and return its result, re-raising the job's exception if it failed.
+
+        Raises:
+            KeyError: The job does not exist or is not finished yet.
+        """
+        with self._lock:
+            future = self._jobs[job_id]
+            if not future.done():
+                raise KeyError(job_id)
+            del self._jobs[job_id]
+            self._finished_at.pop(job_id, None)
+        return future.result()
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, finished_at in self._finished_at.items() if finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+                del self._finished_at[job_id]
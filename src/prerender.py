@@ -0,0 +1,91 @@
+"""Render demo outputs at build time so the site can serve them without loading models.
+
+Run from src/ as part of the deploy:  python prerender.py [demo ...]
+"""
+
+import json
+import os
+import sys
+
+OUTPUT_DIR = "prerendered"
+PALETTE_EXAMPLE_IMAGE = "assets/mitch_pics/mitch0.png"
+
+DEMOS = {}
+_loaded = {}
+
+
+def demo(name):
+    """
+    Register a zero-argument function whose JSON-serializable output is prerendered as name.
+
+    Args:
+        name (str): Name the output is stored and loaded under.
+    """
+    def register(render):
+        DEMOS[name] = render
+        return render
+    return register
+
+
+@demo("toefl-example")
+def toefl_example():
+    """Grading result (score and feedback figures) for the TOEFL example submission."""
+    from tabs import english_proficiency as tab
+    result = tab.grade_text(tab.EXAMPLE_TEXT)
+    return {"score": result["score"], "figures": result["figures"]}
+
+
+@demo("palette-example")
+def palette_example():
+    """Palette extracted from a sample photo by tabs.color_extractor.extract_colors."""
+    from PIL import Image
+    from tabs import color_extractor
+    with Image.open(PALETTE_EXAMPLE_IMAGE) as image:
+        return color_extractor.extract_colors(image).to_dict(orient="records")
+
+
+def build(names=None):
+    """
+    Render demos and write them to OUTPUT_DIR as JSON.
+
+    Args:
+        names (list, optional): Demos to render. Defaults to all registered demos.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    from plotly.utils import PlotlyJSONEncoder
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    paths = []
+    for name in names or DEMOS:
+        path = os.path.join(OUTPUT_DIR, f"{name}.json")
+        with open(path + ".tmp", 'w') as file:
+            json.dump(DEMOS[name](), file, cls=PlotlyJSONEncoder)
+        os.replace(path + ".tmp", path)
+        paths.append(path)
+    return paths
+
+
+def load(name):
+    """
+    Load a prerendered demo output.
+
+    Args:
+        name (str): Demo name.
+
+    Returns:
+        The stored output, or None if it was not built (callers then compute it live).
+    """
+    if name not in _loaded:
+        try:
+            with open(os.path.join(OUTPUT_DIR, f"{name}.json")) as file:
+                _loaded[name] = json.load(file)
+        except (OSError, ValueError):
+            return None
+    return _loaded[name]
+
+
+if __name__ == "__main__":
+    for written in build(sys.argv[1:]):
+        print(f"Wrote {written}")
@@ -0,0 +1,178 @@
+"""Import-time profiler for finding where cold start goes.
+
+Set PROFILE_STARTUP=1 (or to a report path) and start the app as usual. Every module
+imported after install() is timed, split into finding the module and running its
+module-level code, along with the resident memory it added. A report sorted by
+self time is written when app.py finishes loading, and again once the warmup
+thread is done:
+    PROFILE_STARTUP=startup.txt python app.py
+
+Imports made by several threads at once are timed per thread, but their memory
+deltas overlap because RSS is process-wide.
+"""
+
+import os
+import sys
+import threading
+import time
+
+DEFAULT_REPORT = "startup_profile.txt"
+
+_records = {}  # module name -> {"find", "cumulative", "self", "rss_cumulative", "rss_self", "parent"}
+_local = threading.local()
+_lock = threading.Lock()
+_started = None
+
+
+def rss_bytes():
+    """Resident memory of this process, or 0 where it can't be read."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # peak, not current
+    except ImportError:
+        return 0
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+class _TimedLoader:
+    """Wraps a module's loader for the duration of exec_module to time it."""
+
+    def __init__(self, loader, name, find_time):
+        self._loader = loader
+        self._name = name
+        self._find_time = find_time
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        # Put the real loader back, so nothing after import sees the wrapper
+        module.__loader__ = self._loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self._loader
+
+        stack = _stack()
+        parent = stack[-1] if stack else None
+        frame = {"name": self._name, "child_time": 0.0, "child_rss": 0}
+        stack.append(frame)
+        start, start_rss = time.perf_counter(), rss_bytes()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - start + self._find_time
+            rss = rss_bytes() - start_rss
+            if parent is not None:
+                parent["child_time"] += elapsed
+                parent["child_rss"] += rss
+            with _lock:
+                _records[self._name] = {
+                    "find": self._find_time,
+                    "cumulative": elapsed,
+                    "self": elapsed - frame["child_time"],
+                    "rss_cumulative": rss,
+                    "rss_self": rss - frame["child_rss"],
+                    "parent": parent["name"] if parent else None,
+                }
+
+
+class _TimingFinder:
+    """Meta path finder that asks the finders after it and wraps the loader they return."""
+
+    def find_spec(self, name, path=None, target=None):
+        start = time.perf_counter()
+        finders = sys.meta_path[sys.meta_path.index(self) + 1:]
+        for finder in finders:
+            find_spec = getattr(finder, "find_spec", None)
+            spec = find_spec(name, path, target) if find_spec else None
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is None or not hasattr(spec.loader, "exec_module"):
+            return spec
+        spec.loader = _TimedLoader(spec.loader, name, time.perf_counter() - start)
+        return spec
+
+
+def enabled():
+    """Whether PROFILE_STARTUP asks for a report."""
+    return os.environ.get("PROFILE_STARTUP", "0") not in ("", "0")
+
+
+def install():
+    """Start timing imports if PROFILE_STARTUP is set. Call before importing anything heavy."""
+    global _started
+    if not enabled() or _started is not None:
+        return
+    _started = (time.perf_counter(), rss_bytes())
+    sys.meta_path.insert(0, _TimingFinder())
+
+
+def report_path():
+    value = os.environ.get("PROFILE_STARTUP", "")
+    return DEFAULT_REPORT if value == "1" else value
+
+
+def format_report(stage, top_n=None):
+    """
+    Render the recorded imports as text, slowest module-level code first.
+
+    Args:
+        stage (str): Label for when the report was taken, e.g. "boot".
+        top_n (int, optional): Only list this many modules. Defaults to all of them.
+
+    Returns:
+        str: The report.
+    """
+    with _lock:
+        records = dict(_records)
+    start, start_rss = _started
+    by_package = {}
+    for name, record in records.items():
+        package = by_package.setdefault(name.partition(".")[0], [0.0, 0])
+        package[0] += record["self"]
+        package[1] += record["rss_self"]
+
+    lines = [
+        f"Startup profile after {stage}",
+        f"elapsed since install: {(time.perf_counter() - start) * 1000:.0f} ms, "
+        f"RSS {start_rss / 2**20:.0f} MB -> {rss_bytes() / 2**20:.0f} MB, {len(records)} modules imported",
+        "",
+        "By top-level package:",
+        f"{'self ms':>10} {'self MB':>9}  package",
+    ]
+    for package, (seconds, rss) in sorted(by_package.items(), key=lambda item: -item[1][0]):
+        lines.append(f"{seconds * 1000:>10.1f} {rss / 2**20:>9.1f}  {package}")
+
+    lines += ["", "By module (self = module-level code minus nested imports, cum = with them):",
+              f"{'self ms':>10} {'cum ms':>10} {'find ms':>8} {'self MB':>8} {'cum MB':>8}  module (imported by)"]
+    ordered = sorted(records.items(), key=lambda item: -item[1]["self"])
+    for name, record in ordered[:top_n]:
+        lines.append(f"{record['self'] * 1000:>10.1f} {record['cumulative'] * 1000:>10.1f} "
+                     f"{record['find'] * 1000:>8.2f} {record['rss_self'] / 2**20:>8.1f} "
+                     f"{record['rss_cumulative'] / 2**20:>8.1f}  {name} ({record['parent'] or '-'})")
+    return "\n".join(lines) + "\n"
+
+
+def write_report(stage):
+    """Write the report to the PROFILE_STARTUP path, if profiling is on."""
+    if _started is None:
+        return
+    path = report_path()
+    with open(path, "w") as file:
+        file.write(format_report(stage))
+    print(f"Startup profile ({stage}) written to {os.path.abspath(path)}", file=sys.stderr)
@@ -1,2 +1 @@
-from . import (about, aphasia, english_proficiency, homepage, not_found,
-               perception, portfolio, resume, scout)
+"""Site pages. app.PAGES maps paths to these modules, which are imported on first use."""
@@ -1,11 +1,29 @@
 """Code to extract a color palette from a PIL Image."""
 
+import os
+import threading
+
 import colorspacious
 import numpy as np
 import pandas as pd
 from PIL import Image
-from sitemotive.colors.color import ColorConverter
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+# Clustering engines for get_clusters; see benchmarks/palette.py for how they compare
+PALETTE_ENGINES = ("kmeans", "minibatch", "histogram", "median-cut")
+PALETTE_ENGINE = os.environ.get("PALETTE_ENGINE", "kmeans")
+# Edge length of the histogram bins in CAM02-UCS units (a just-noticeable difference is about 1)
+HISTOGRAM_BIN_SIZE = 2.0
+
+# CAM02-UCS value of every 8-bit sRGB color (256 x 256 x 256 x 3 float32, ~200 MB), memory-mapped.
+# Off by default (colors are converted with colorspacious); set CAM_LUT_PATH to a file outside
+# the deployed tree to build it there on first use. Batch jobs turn it on with --cam-lut.
+CAM_LUT_PATH = os.environ.get("CAM_LUT_PATH", "")
+DEFAULT_CAM_LUT_PATH = "tabs/cam02ucs_lut.npy"
+# float32 storage is the only difference from colorspacious (checked by check_cam_lut)
+CAM_LUT_MAX_ERROR = 1e-4
+_cam_lut = None
+_cam_lut_lock = threading.Lock()
 
 def resize_image(image, max_img_size):
     """Resizes an image while preserving its aspect ratio.
@@ -37,6 +55,137 @@ def resize_image(image, max_img_size):
     return image
 
 
+def build_cam_lut(path):
+    """Convert every 8-bit sRGB color to CAM02-UCS and save the table as a .npy file
+
+    Parameters
+    ----------
+    path : str
+        where to write the table; it is written to a temporary file of this process first
+        and moved into place, so processes building it at the same time don't clash
+
+    Returns
+    -------
+    np.memmap
+        the table, indexed by [red, green, blue]
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        lut = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(256, 256, 256, 3))
+        green_blue = np.stack(np.meshgrid(np.arange(256), np.arange(256), indexing="ij"), axis=-1).reshape(-1, 2)
+        for red in range(256):  # one red plane at a time keeps colorspacious' float64 temporaries small
+            plane = np.column_stack([np.full(len(green_blue), red), green_blue])
+            lut[red] = colorspacious.cspace_convert(plane, "sRGB255", "CAM02-UCS").reshape(256, 256, 3)
+        lut.flush()
+        del lut
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return np.load(path, mmap_mode="r")
+
+
+def cam_lut():
+    """Load (building it if needed) the sRGB to CAM02-UCS lookup table
+
+    Returns
+    -------
+    np.memmap or None
+        the table, or None if CAM_LUT_PATH is empty
+
+    Raises
+    ------
+    OSError
+        if the table has to be built and can't be written; conversions never switch
+        between the table and colorspacious within a run
+    """
+    global _cam_lut
+    if _cam_lut is None and CAM_LUT_PATH:
+        with _cam_lut_lock:
+            if _cam_lut is None:
+                try:
+                    _cam_lut = np.load(CAM_LUT_PATH, mmap_mode="r")
+                except (OSError, ValueError):
+                    _cam_lut = build_cam_lut(CAM_LUT_PATH)
+    return _cam_lut
+
+
+def srgb_to_cam(rgb):
+    """Convert 8-bit sRGB colors to CAM02-UCS
+
+    Parameters
+    ----------
+    rgb : np.array
+        array of sRGB colors with values from 0 to 255, shape (..., 3)
+
+    Returns
+    -------
+    np.array
+        array of CAM02UCS color values with the same shape
+    """
+    rgb = np.asarray(rgb, dtype=np.uint8)
+    lut = cam_lut()
+    if lut is None:
+        return colorspacious.cspace_convert(rgb, "sRGB255", "CAM02-UCS")
+    return lut[rgb[..., 0], rgb[..., 1], rgb[..., 2]].astype(np.float64)
+
+
+def cam_to_rgb(cam):
+    """Convert CAM02-UCS colors to 8-bit sRGB, clipping colors outside the sRGB gamut
+
+    Parameters
+    ----------
+    cam : np.array
+        array of CAM02UCS colors, shape (..., 3)
+
+    Returns
+    -------
+    np.array
+        array of sRGB colors as uint8
+    """
+    rgb = colorspacious.cspace_convert(np.asarray(cam, dtype=np.float64), "CAM02-UCS", "sRGB255")
+    return np.clip(np.round(rgb), 0, 255).astype(np.uint8)
+
+
+def rgb_to_hex(rgb):
+    """Format sRGB colors as hexcodes
+
+    Parameters
+    ----------
+    rgb : np.array
+        array of uint8 sRGB colors, shape (n, 3)
+
+    Returns
+    -------
+    list
+        hexcodes such as "#1a2b3c"
+    """
+    return ["#%02x%02x%02x" % tuple(color) for color in np.asarray(rgb).tolist()]
+
+
+def check_cam_lut(n_colors=100_000, seed=0):
+    """Measure how far the lookup table is from colorspacious on random colors
+
+    Parameters
+    ----------
+    n_colors : int, optional
+        number of random colors to compare, by default 100000
+
+    seed : int, optional
+        random seed, by default 0
+
+    Returns
+    -------
+    float
+        largest CAM02-UCS distance (delta-E) between the two conversions
+    """
+    colors = np.random.default_rng(seed).integers(0, 256, size=(n_colors, 3))
+    expected = colorspacious.cspace_convert(colors, "sRGB255", "CAM02-UCS")
+    error = float(np.linalg.norm(srgb_to_cam(colors) - expected, axis=1).max())
+    assert error <= CAM_LUT_MAX_ERROR, f"lookup table is off by {error} delta-E"
+    return error
+
+
 def image_to_cam_array(image):
     """Translate PIL image to a numpy array of CAM02UCS colors
 
@@ -53,12 +202,109 @@ def image_to_cam_array(image):
     # Open the image using PIL
     image = image.convert('RGB')
     # Convert the image to CAM02UCS color space
-    cam_image = colorspacious.cspace_convert(np.array(image), "sRGB255", "CAM02-UCS").reshape(-1,3)
+    cam_image = srgb_to_cam(np.array(image)).reshape(-1,3)
     return cam_image
 
 
-def get_clusters(pixel_array, n_clusters):
-    """Perform clustering on pixel array using KMeans and return resulting cluster labels
+def color_histogram(pixel_array, bin_size=HISTOGRAM_BIN_SIZE, sample_weight=None):
+    """Bin pixels into a 3D color histogram
+
+    Parameters
+    ----------
+    pixel_array : np.array
+        numpy array of pixels
+
+    bin_size : float, optional
+        edge length of each bin, by default HISTOGRAM_BIN_SIZE
+
+    sample_weight : np.array, optional
+        number of pixels each row of pixel_array stands for, by default 1
+
+    Returns
+    -------
+    np.array
+        mean color of the pixels in each non-empty bin
+    np.array
+        number of pixels in each bin
+    np.array
+        bin index of every pixel
+    """
+    if sample_weight is None:
+        sample_weight = np.ones(len(pixel_array))
+    bins = np.floor(pixel_array / bin_size).astype(np.int64)
+    _, pixel_bins = np.unique(bins, axis=0, return_inverse=True)
+    pixel_bins = pixel_bins.reshape(-1)
+    counts = np.bincount(pixel_bins, weights=sample_weight)
+    centers = np.stack([np.bincount(pixel_bins, weights=pixel_array[:, i] * sample_weight) for i in range(3)], axis=1)
+    return centers / counts[:, None], counts, pixel_bins
+
+
+def median_cut(colors, weights, n_clusters):
+    """Split weighted colors into boxes by repeatedly cutting the widest box at its weighted median
+
+    Parameters
+    ----------
+    colors : np.array
+        array of colors
+
+    weights : np.array
+        weight (pixel count) of each color
+
+    n_clusters : int
+        number of boxes to cut the colors into
+
+    Returns
+    -------
+    np.array
+        box label of each color
+    np.array
+        weighted mean color of each box
+    """
+    boxes = [np.arange(len(colors))]
+    while len(boxes) < n_clusters:
+        splittable = [i for i, box in enumerate(boxes) if len(box) > 1]
+        if not splittable:
+            break
+        # Widest extent weighted by pixel count, so large flat areas still get split
+        spreads = [np.ptp(colors[boxes[i]], axis=0).max() * weights[boxes[i]].sum() for i in splittable]
+        box = boxes.pop(splittable[int(np.argmax(spreads))])
+        axis = np.ptp(colors[box], axis=0).argmax()
+        box = box[np.argsort(colors[box, axis], kind="stable")]
+        cumulative = np.cumsum(weights[box])
+        cut = int(np.clip(np.searchsorted(cumulative, cumulative[-1] / 2) + 1, 1, len(box) - 1))
+        boxes += [box[:cut], box[cut:]]
+
+    labels = np.empty(len(colors), dtype=np.int64)
+    centers = np.empty((len(boxes), 3))
+    for label, box in enumerate(boxes):
+        labels[box] = label
+        centers[label] = np.average(colors[box], axis=0, weights=weights[box])
+    return labels, centers
+
+
+def image_to_cam_counts(image):
+    """Translate PIL image to its distinct CAM02UCS colors and how many pixels have each
+
+    Parameters
+    ----------
+    image : PIL.Image
+        PIL Image
+
+    Returns
+    -------
+    np.array
+        array of distinct CAM02UCS color values
+    np.array
+        number of pixels of each color
+    """
+    rgb = np.asarray(image.convert('RGB')).reshape(-1, 3).astype(np.int32)
+    packed, counts = np.unique((rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2], return_counts=True)
+    colors = np.stack([packed >> 16, (packed >> 8) & 255, packed & 255], axis=1)
+    return srgb_to_cam(colors).reshape(-1, 3), counts
+
+
+def get_clusters(pixel_array, n_clusters, engine=None, sample_weight=None):
+    """Perform clustering on pixel array and return resulting cluster labels
 
     Parameters
     ----------
@@ -68,6 +314,16 @@ def get_clusters(pixel_array, n_clusters):
     n_clusters : int
         number of clusters to use
 
+    engine : str, optional
+        one of PALETTE_ENGINES, by default PALETTE_ENGINE:
+            - "kmeans": KMeans over every pixel
+            - "minibatch": MiniBatchKMeans over every pixel
+            - "histogram": weighted KMeans over the bins of a color histogram
+            - "median-cut": median cut over the bins of a color histogram
+
+    sample_weight : np.array, optional
+        number of pixels each row of pixel_array stands for, by default 1
+
     Returns
     -------
     np.array
@@ -75,8 +331,63 @@ def get_clusters(pixel_array, n_clusters):
     np.array
         array of cluster centers
     """
-    clustering = KMeans(n_clusters=n_clusters, random_state=42).fit(pixel_array)
-    return clustering.labels_, clustering.cluster_centers_
+    engine = engine or PALETTE_ENGINE
+    if engine == "kmeans":
+        clustering = KMeans(n_clusters=n_clusters, random_state=42).fit(pixel_array, sample_weight=sample_weight)
+        return clustering.labels_, clustering.cluster_centers_
+    if engine == "minibatch":
+        clustering = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3,
+                                     batch_size=1024).fit(pixel_array, sample_weight=sample_weight)
+        return clustering.labels_, clustering.cluster_centers_
+    if engine not in PALETTE_ENGINES:
+        raise ValueError(f"Unknown palette engine {engine!r}, expected one of {PALETTE_ENGINES}")
+
+    bin_colors, bin_counts, pixel_bins = color_histogram(pixel_array, sample_weight=sample_weight)
+    n_clusters = min(n_clusters, len(bin_colors))
+    if engine == "histogram":
+        clustering = KMeans(n_clusters=n_clusters, random_state=42).fit(bin_colors, sample_weight=bin_counts)
+        bin_labels, centers = clustering.labels_, clustering.cluster_centers_
+    else:
+        bin_labels, centers = median_cut(bin_colors, bin_counts, n_clusters)
+    return bin_labels[pixel_bins], centers
+
+
+def min_distances(centers, reference=None):
+    """Distance from each center to the nearest other center
+
+    Parameters
+    ----------
+    centers : np.array
+        array of cluster centers
+
+    reference : np.array, optional
+        centers to measure against, by default centers itself (row i is never compared to row i)
+
+    Returns
+    -------
+    np.array
+        minimum distance of each center
+    """
+    reference = centers if reference is None else reference
+    differences = centers[:, None, :] - reference[None, :, :]
+    distances = np.sqrt(np.einsum("ijk,ijk->ij", differences, differences))
+    np.fill_diagonal(distances, np.inf)
+    return distances.min(axis=1)
+
+
+def _keep_mask(min_dists, compare_to, threshold):
+    """Keep each color unless its min_dist is below threshold and equals compare_to of an earlier kept color
+
+    Only the (rare) colors that match some earlier color are resolved one by one, since
+    whether they are dropped depends on which earlier colors were kept.
+    """
+    n = len(min_dists)
+    repeats = ((min_dists[:, None] == compare_to[None, :]) & np.tri(n, k=-1, dtype=bool)
+               & (min_dists < threshold)[:, None])
+    keep = np.ones(n, dtype=bool)
+    for i in np.flatnonzero(repeats.any(axis=1)):
+        keep[i] = not (repeats[i] & keep).any()
+    return keep
 
 
 def get_unique_colors(cluster_centers):
@@ -92,17 +403,42 @@ def get_unique_colors(cluster_centers):
     list
         list of unique colors along with their minimum distances
     """
-    unique_colors = []
-    for i, center in enumerate(cluster_centers):
-        distances = np.linalg.norm(center - cluster_centers, axis=1)
-        distances[i] = np.inf
-        min_dist = np.min(distances)
-        if len(unique_colors) == 0  or not (min_dist in [c[1] for c in unique_colors] and min_dist < 10):
-            unique_colors.append((i, min_dist))
-    return unique_colors
+    min_dists = min_distances(cluster_centers)
+    keep = _keep_mask(min_dists, min_dists, 10)
+    return [(i, min_dists[i]) for i in np.flatnonzero(keep)]
+
+
+def merge_colors(cluster_centers, dominance, merge_threshold):
+    """Merge colors closer than merge_threshold into the most dominant color among them
+
+    Parameters
+    ----------
+    cluster_centers : np.array
+        array of cluster centers
+
+    dominance : np.array
+        share of the image covered by each cluster
+
+    merge_threshold : float
+        colors closer than this (in CAM02-UCS units) are merged
+
+    Returns
+    -------
+    np.array
+        indices of the remaining clusters
+    np.array
+        dominance of each remaining cluster, including the clusters merged into it
+    """
+    distances = np.linalg.norm(cluster_centers[:, None, :] - cluster_centers[None, :, :], axis=2)
+    owner = np.full(len(cluster_centers), -1)
+    for i in np.argsort(-dominance, kind="stable"):
+        if owner[i] == -1:
+            owner[(owner == -1) & (distances[i] < merge_threshold)] = i
+    kept = np.unique(owner)
+    return kept, np.bincount(owner, weights=dominance, minlength=len(cluster_centers))[kept]
 
 
-def get_color_scores(cluster_centers, cluster_labels, min_dist_threshold=10):
+def get_color_scores(cluster_centers, cluster_labels, min_dist_threshold=10, sample_weight=None, merge_threshold=None):
     """Calculate the weighted score for each unique color based on dominance and distinctiveness.
 
     Parameters
@@ -117,6 +453,15 @@ def get_color_scores(cluster_centers, cluster_labels, min_dist_threshold=10):
         The minimum distance threshold to consider colors as distinct. Colors with distances
         below this threshold will be considered similar. Default is 10.
 
+    sample_weight : np.array, optional
+        Number of pixels each label stands for, when the labels are for distinct colors
+        rather than pixels. Default is 1.
+
+    merge_threshold : float, optional
+        If given, colors closer than this are first merged into the most dominant of them
+        (see merge_colors), and min_dist is measured between the remaining colors. Default
+        is None, which keeps every cluster.
+
     Returns
     -------
     list
@@ -132,23 +477,24 @@ def get_color_scores(cluster_centers, cluster_labels, min_dist_threshold=10):
     The color distinctiveness is determined by the minimum distance between a color and other colors considered in the palette.
     By combining these factors, the function generates a weighted score for each unique color.
     """
-    unique_colors = []
+    if sample_weight is None:
+        sample_weight = np.ones(len(cluster_labels))
+    pixel_counts = np.bincount(cluster_labels, weights=sample_weight, minlength=len(cluster_centers))
+    dominance = pixel_counts / pixel_counts.sum()
+    if merge_threshold is not None:
+        kept, dominance = merge_colors(cluster_centers, dominance, merge_threshold)
+        cluster_centers = cluster_centers[kept]
+
+    rounded = np.round(cluster_centers, 2)
+    min_dists = min_distances(rounded, cluster_centers)
+    keep = _keep_mask(min_dists, dominance, min_dist_threshold)
 
-    for i, center in enumerate(cluster_centers):
-        center = np.array([round(c, 2) for c in center])
-        distances = np.linalg.norm(center - cluster_centers, axis=1)
-        distances[i] = np.inf
-        min_dist = np.min(distances)
-        if len(unique_colors) == 0 or not (min_dist in [c[1] for c in unique_colors] and min_dist < min_dist_threshold):
-            pixels = np.where(cluster_labels == i)
-            dominance_score = len(pixels[0]) / len(cluster_labels)
-            rgb = ColorConverter.CAM02UCS_to_RGB(center)
-            hexcode = ColorConverter.RGB_to_HEX(rgb)
-            unique_colors.append((hexcode, dominance_score, min_dist))
-    return unique_colors
+    hexcodes = rgb_to_hex(cam_to_rgb(rounded[keep]))
+    return list(zip(hexcodes, dominance[keep].tolist(), min_dists[keep].tolist()))
 
 
-def extract_colors(pil_image, max_img_size=150, n_clusters=10, max_colors=7, min_dist_cutoff=8):
+def extract_colors(pil_image, max_img_size=150, n_clusters=10, max_colors=7, min_dist_cutoff=8, engine=None,
+                   merge_threshold=None):
     """Extract color palette from an image
 
     Parameters
@@ -169,6 +515,12 @@ def extract_colors(pil_image, max_img_size=150, n_clusters=10, max_colors=7, min
         Minimum distance between other colors that a color needs to have in order to not be considered a
         duplicate color, by default 8
 
+    engine : str, optional
+        Clustering engine (see get_clusters), by default PALETTE_ENGINE
+
+    merge_threshold : float, optional
+        Merge clusters closer than this before scoring (see get_color_scores), by default None
+
     Returns
     -------
     pd.DataFrame
@@ -177,14 +529,14 @@ def extract_colors(pil_image, max_img_size=150, n_clusters=10, max_colors=7, min
             - dominance_score (float): Approximately how much that color makes up the image
             - min_dist (float): Minimum distance found between the color and other colors considered
     """
-    # Get clusters
+    # Get clusters of the distinct colors, weighted by how many pixels have them
     image = resize_image(pil_image, max_img_size)
-    pixel_array = image_to_cam_array(image)
-    n_clusters = min(n_clusters, np.unique(pixel_array, axis=0).shape[0])
-    cluster_labels, cluster_centers = get_clusters(pixel_array, n_clusters)
+    colors, counts = image_to_cam_counts(image)
+    n_clusters = min(n_clusters, len(colors))
+    cluster_labels, cluster_centers = get_clusters(colors, n_clusters, engine, sample_weight=counts)
 
     # Get minimum distances
-    scores = get_color_scores(cluster_centers, cluster_labels)
+    scores = get_color_scores(cluster_centers, cluster_labels, sample_weight=counts, merge_threshold=merge_threshold)
 
     # Sort the list of unique colors based on their weighted score
     scores.sort(key=lambda x: x[1], reverse=True)
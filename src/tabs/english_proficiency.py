@@ -2,7 +2,20 @@ import dash
 from dash import Input, Output, State, dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from english_proficiency_r import english_proficiency as ep
+import os
+import threading
+
+# Dash's JSON encoder (via plotly) inspects numpy/pandas whenever they are in sys.modules.
+# Import them up front so a grading job loading them in the background is never seen
+# half-initialized by a concurrent request.
+import numpy
+import pandas
+
+import jobs
+import prerender
+from cache import ResultCache, content_key
+from english_proficiency_r import model_registry
+from english_proficiency_r.worker_pool import PoolBusy
 
 # Initialize the Dash app
 app = dash.Dash(__name__)
@@ -10,6 +23,27 @@ app = dash.Dash(__name__)
 with open("english_proficiency_r/example_submission.txt", 'r') as file:
     EXAMPLE_TEXT = file.read().replace('\n', ' ')
 
+# Grading results keyed by a hash of the normalized essay. Set EP_CACHE_DIR to keep
+# results across worker restarts.
+GRADING_CACHE = ResultCache(max_bytes=int(os.environ.get("EP_CACHE_MAX_BYTES", 16 << 20)),
+                            ttl=int(os.environ.get("EP_CACHE_TTL", 24 * 3600)),
+                            disk_dir=os.environ.get("EP_CACHE_DIR"))
+
+# Grading worker processes (0 grades in this process) and requests allowed to wait for one
+WORKER_PROCESSES = int(os.environ.get("EP_WORKER_PROCESSES", 0))
+WORKER_MAX_PENDING = int(os.environ.get("EP_WORKER_MAX_PENDING", 8))
+
+# Grading runs off the request threads so page navigation stays responsive. With worker
+# processes, job threads only wait on the pool, so there is one per pool slot by default.
+GRADING_JOBS = jobs.JobQueue(
+    max_workers=int(os.environ.get("EP_GRADING_WORKERS",
+                                   WORKER_PROCESSES + WORKER_MAX_PENDING if WORKER_PROCESSES > 0 else 2)),
+    name="grading")
+POLL_INTERVAL_MS = 500
+
+_grading_pool = None
+_grading_pool_lock = threading.Lock()
+
 
 # Define the layout of the Dash app
 BANNER_STYLE = {
@@ -52,13 +86,67 @@ LAYOUT = html.Div([
         dbc.Button('Grade', id={'type': 'toefl-run-button', 'index': 0}),
         dbc.Button('Grade Placeholder', id={'type': 'toefl-grade-placeholder', 'index': 0}, style={'margin-left': '10px'}),
         html.Br(),
-        dcc.Loading(html.Div(id={"type": 'toefl-output-div', "index": 0}), type="dot")
+        html.Div(id={"type": 'toefl-output-div', "index": 0}),
+        dcc.Store(id={'type': 'toefl-job', 'index': 0}),
+        dcc.Interval(id={'type': 'toefl-poll', 'index': 0}, interval=POLL_INTERVAL_MS, disabled=True)
     ], style={'width': '80%', 'margin-left': '10%', "margin-top": "100px", 'font-size': '20px'})
 ])
 
-def text_to_div(text):
-    pred, pos_cols, english = ep.text2pred(text)
-    figs = ep.get_figs(pos_cols, english)
+def grading_pool():
+    """
+    The process pool grading runs on, started on first use, or None when disabled.
+
+    Set EP_WORKER_PROCESSES to the number of processes to enable it; each one loads
+    spaCy and the forest once. The pool takes EP_WORKER_PROCESSES + EP_WORKER_MAX_PENDING
+    requests at a time, shared by page gradings (GRADING_JOBS threads, as many by
+    default; EP_GRADING_WORKERS overrides it) and API requests; past that it answers busy.
+    """
+    global _grading_pool
+    if WORKER_PROCESSES <= 0:
+        return None
+    with _grading_pool_lock:
+        if _grading_pool is None:
+            from english_proficiency_r.worker_pool import GradingPool
+            _grading_pool = GradingPool(WORKER_PROCESSES, max_pending=WORKER_MAX_PENDING,
+                                        timeout=float(os.environ.get("EP_WORKER_TIMEOUT", 60)))
+    return _grading_pool
+
+def normalize_text(text):
+    """Collapse runs of whitespace so trivially different submissions share a cache entry."""
+    return " ".join(text.split())
+
+def grade_text(text):
+    """
+    Grade an essay, reusing the cached result for identical (normalized) text.
+
+    Returns:
+        dict: english_proficiency.grade_result output: "score", "features", "figures" and "model_version".
+    """
+    text = normalize_text(text)
+
+    def compute():
+        pool = grading_pool()
+        if pool is not None:
+            return pool.grade(text)
+        # Imported here so serving prerendered output never loads spaCy or the model
+        from english_proficiency_r import english_proficiency as ep
+        return ep.grade_result(text)
+
+    model_version = (model_registry.load_manifest() or {}).get("version")
+    result = GRADING_CACHE.get(content_key("toefl", model_version, text))
+    if result is None:
+        result = compute()
+        # Keyed by the model that graded it: a process keeps its model until it restarts,
+        # so right after a new version is published its results are not that version's
+        GRADING_CACHE.set(content_key("toefl", result["model_version"], text), result)
+    return result
+
+def cache_stats():
+    """Hit/miss counters of the grading cache."""
+    return GRADING_CACHE.stats()
+
+def result_to_div(result):
+    pred, figs = result["score"], result["figures"]
     graph_row = dbc.Row(
         [dbc.Col(dcc.Graph(figure=fig, config={'displayModeBar': False}), width=6) for fig in figs]
     )
@@ -67,22 +155,46 @@ def text_to_div(text):
                     alongside a histogram that compares your score (red line)
                     to the distribution of test-takers who passed the exam.""")] + [graph_row]
 
+def text_to_div(text):
+    return result_to_div(grade_text(text))
+
+GRADING_DIV = [html.Br(), dbc.Spinner(size="sm"), html.Span(" Grading your essay...", style={'margin-left': '10px'})]
+
 # Define the callback function to run the R script
 def add_callbacks(app: dash.Dash):
     @app.callback(
         Output({"type": 'toefl-output-div', "index": 0}, 'children'),
         Output({"type": 'toefl-modal', "index": 0}, 'children'),
+        Output({'type': 'toefl-job', 'index': 0}, 'data'),
+        Output({'type': 'toefl-poll', 'index': 0}, 'disabled'),
         Input({"type": "toefl-run-button", "index": 0}, 'n_clicks'),
         Input({'type': 'toefl-grade-placeholder', 'index': 0}, 'n_clicks'),
+        Input({'type': 'toefl-poll', 'index': 0}, 'n_intervals'),
         State({'type': 'ep-input', 'index': 0}, 'value'),
+        State({'type': 'toefl-job', 'index': 0}, 'data'),
         prevent_initial_call = True
     )
-    def analyze_text(grade_clicks, placeholder_clicks, text):
-        if dash.callback_context.triggered_id == {'index': 0, 'type': 'toefl-grade-placeholder'}:
-            return text_to_div(EXAMPLE_TEXT), dash.no_update
-        elif not text:
-            return dash.no_update, dbc.Modal(dbc.ModalBody('Please enter text to grade or click "Grade Placeholer".'), is_open=True)
-        else:
-            return text_to_div(text), dash.no_update
-
+    def analyze_text(grade_clicks, placeholder_clicks, n_intervals, text, job_id):
+        triggered = dash.callback_context.triggered_id
+        if triggered == {'index': 0, 'type': 'toefl-poll'}:
+            status = GRADING_JOBS.status(job_id)
+            if status in (jobs.PENDING, jobs.RUNNING):
+                return dash.no_update, dash.no_update, dash.no_update, False
+            if status == jobs.UNKNOWN:
+                # Jobs live in memory: a restart or deploy, or result_ttl running out, loses them
+                return html.P("Grading was interrupted. Please grade your essay again."), dash.no_update, None, True
+            try:
+                return result_to_div(GRADING_JOBS.pop_result(job_id)), dash.no_update, None, True
+            except PoolBusy:
+                return html.P("All graders are busy right now. Please try again in a moment."), dash.no_update, None, True
+            except Exception:
+                return html.P("Sorry, something went wrong while grading. Please try again."), dash.no_update, None, True
 
+        if triggered == {'index': 0, 'type': 'toefl-grade-placeholder'}:
+            prerendered = prerender.load("toefl-example")
+            if prerendered is not None:
+                return result_to_div(prerendered), dash.no_update, None, True
+            text = EXAMPLE_TEXT
+        elif not text:
+            return dash.no_update, dbc.Modal(dbc.ModalBody('Please enter text to grade or click "Grade Placeholer".'), is_open=True), dash.no_update, dash.no_update
+        return GRADING_DIV, dash.no_update, GRADING_JOBS.submit(grade_text, text), False
@@ -0,0 +1,310 @@
+"""Extract palettes from many images in parallel, streaming results to disk.
+
+Images are decoded, resized and clustered in a pool of processes, and every result is
+written as soon as it arrives. An image that fails gets an error row instead of
+stopping the batch. Rerunning the same command skips images that already have a
+palette in the output and retries the ones that failed.
+
+Run from src/:
+    python -m tabs.palette_batch images/ palettes.csv
+    python -m tabs.palette_batch paths.txt palettes.jsonl --processes 8
+    python -m tabs.palette_batch images/ palettes_parquet --format parquet   (needs pyarrow)
+    python -m tabs.palette_batch images/ palettes.csv --cam-lut /tmp/cam02ucs_lut.npy
+"""
+
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+FORMATS = ("csv", "jsonl", "parquet")
+CSV_COLUMNS = ["path", "rank", "hexcode", "dominance_score", "min_dist", "error"]
+
+
+def iter_image_paths(source):
+    """
+    List the images to process.
+
+    Args:
+        source (str or iterable): A directory (searched recursively for IMAGE_EXTENSIONS),
+            a text file with one path per line, or an iterable of paths.
+
+    Yields:
+        str: Image paths.
+    """
+    if not isinstance(source, str):
+        yield from source
+    elif os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, "**", "*"), recursive=True)):
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                yield path
+    else:
+        with open(source) as file:
+            for line in file:
+                if line.strip():
+                    yield line.strip()
+
+
+def _init_worker(cam_lut_path):
+    # Processes already run in parallel, so keep KMeans from starting its own threads in each
+    from threadpoolctl import threadpool_limits
+
+    from tabs import color_extractor
+    threadpool_limits(1)
+    color_extractor.CAM_LUT_PATH = cam_lut_path
+
+
+def extract_one(path, options, cache=None):
+    """
+    Extract the palette of one image, returning an error instead of raising.
+
+    Args:
+        path (str): Image file.
+        options (dict): Keyword arguments for color_extractor.extract_colors.
+        cache (str, optional): "exact" or "perceptual" to go through tabs.palette_cache. Defaults to None.
+
+    Returns:
+        dict: "path", and either "palette" (list of color dicts) or "error".
+    """
+    from PIL import Image
+
+    from tabs import color_extractor
+
+    try:
+        if cache:
+            from tabs import palette_cache
+            palette = palette_cache.cached_extract_colors(path, perceptual=cache == "perceptual", **options)
+        else:
+            with Image.open(path) as image:
+                # JPEGs can be decoded straight at a fraction of their size
+                size = options.get("max_img_size", 150)
+                image.draft("RGB", (size, size))
+                palette = color_extractor.extract_colors(image, **options)
+        return {"path": path, "palette": [
+            {"hexcode": row["hexcode"], "dominance_score": float(row["dominance_score"]),
+             "min_dist": float(row["min_dist"])} for row in palette.to_dict(orient="records")]}
+    except Exception as error:
+        return {"path": path, "error": f"{type(error).__name__}: {error}"}
+
+
+def _extract_star(args):
+    return extract_one(*args)
+
+
+def extract_palettes(paths, processes=None, chunksize=4, cache=None, cam_lut=None, **options):
+    """
+    Extract palettes in a process pool, yielding results in completion order.
+
+    Args:
+        paths (iterable): Image paths; consumed lazily.
+        processes (int, optional): Worker processes. Defaults to the number of CPUs.
+        chunksize (int, optional): Images handed to a worker at a time. Defaults to 4.
+        cache (str, optional): Palette cache mode, see extract_one. Defaults to None.
+        cam_lut (str, optional): Color conversion lookup table (see color_extractor.cam_lut),
+            built here before the workers start if it doesn't exist. Defaults to $CAM_LUT_PATH.
+        **options: Keyword arguments for color_extractor.extract_colors.
+
+    Yields:
+        dict: extract_one output per image.
+    """
+    from tabs import color_extractor
+
+    color_extractor.CAM_LUT_PATH = cam_lut or color_extractor.CAM_LUT_PATH
+    color_extractor.cam_lut()
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(color_extractor.CAM_LUT_PATH,)) as pool:
+        yield from pool.imap_unordered(_extract_star, ((path, options, cache) for path in paths), chunksize)
+
+
+class CsvWriter:
+    """One row per palette color; failed images get a row with only path and error."""
+
+    def __init__(self, path, append=True):
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, 'a' if append else 'w', newline="")
+        self._writer = csv.DictWriter(self._file, CSV_COLUMNS)
+        if not exists:
+            self._writer.writeheader()
+
+    @staticmethod
+    def done_paths(path):
+        with open(path, newline="") as file:
+            return {row["path"] for row in csv.DictReader(file) if row["hexcode"]}
+
+    def write(self, result):
+        if "error" in result:
+            self._writer.writerow({"path": result["path"], "error": result["error"]})
+        for rank, color in enumerate(result.get("palette", [])):
+            self._writer.writerow({"path": result["path"], "rank": rank, **color})
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter:
+    """One JSON object per image."""
+
+    def __init__(self, path, append=True):
+        self._file = open(path, 'a' if append else 'w')
+
+    @staticmethod
+    def done_paths(path):
+        done = set()
+        with open(path) as file:
+            for line in file:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interrupted run
+                if "palette" in result:
+                    done.add(result["path"])
+        return done
+
+    def write(self, result):
+        self._file.write(json.dumps(result) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    A directory of Parquet files with the CSV columns, one file per run.
+
+    Rows are buffered and written as a row group every rows_per_group rows. Without
+    append, the files of earlier runs are removed.
+    """
+
+    def __init__(self, path, append=True, rows_per_group=10_000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow)") from None
+        os.makedirs(path, exist_ok=True)
+        if not append:
+            for part in glob.glob(os.path.join(path, "part-*.parquet")):
+                os.remove(part)
+        self._pa = pa
+        self._schema = pa.schema([("path", pa.string()), ("rank", pa.int32()), ("hexcode", pa.string()),
+                                  ("dominance_score", pa.float64()), ("min_dist", pa.float64()),
+                                  ("error", pa.string())])
+        part = len(glob.glob(os.path.join(path, "part-*.parquet")))
+        self._writer = pq.ParquetWriter(os.path.join(path, f"part-{part:05d}.parquet"), self._schema)
+        self._rows = []
+        self._rows_per_group = rows_per_group
+
+    @staticmethod
+    def done_paths(path):
+        import pyarrow.parquet as pq
+        done = set()
+        for part in glob.glob(os.path.join(path, "part-*.parquet")):
+            try:
+                table = pq.read_table(part, columns=["path", "hexcode"]).to_pydict()
+                done.update(path for path, hexcode in zip(table["path"], table["hexcode"]) if hexcode)
+            except Exception:
+                pass  # a file left unfinished by an interrupted run
+        return done
+
+    def write(self, result):
+        if "error" in result:
+            self._rows.append({"path": result["path"], "error": result["error"]})
+        for rank, color in enumerate(result.get("palette", [])):
+            self._rows.append({"path": result["path"], "rank": rank, **color})
+        if len(self._rows) >= self._rows_per_group:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+def guess_format(output):
+    extension = os.path.splitext(output)[1].lower().lstrip(".")
+    return {"ndjson": "jsonl", "pq": "parquet"}.get(extension, extension) if extension else "parquet"
+
+
+def run_batch(source, output, output_format=None, processes=None, resume=True, progress_every=2.0, cache=None,
+              cam_lut=None, **options):
+    """
+    Extract palettes for every image in source and stream them to output.
+
+    Args:
+        source (str or iterable): See iter_image_paths.
+        output (str): Output file (csv / jsonl) or directory (parquet).
+        output_format (str, optional): One of FORMATS. Guessed from the output extension by default.
+        processes (int, optional): Worker processes. Defaults to the number of CPUs.
+        resume (bool, optional): Skip images that already have a palette in output; failed
+            images are retried and get a new row. If False, output is replaced. Defaults to True.
+        progress_every (float, optional): Seconds between progress lines on stderr. Defaults to 2.
+        cache (str, optional): Palette cache mode, see extract_one. Defaults to None.
+        cam_lut (str, optional): Color conversion lookup table, see extract_palettes. Defaults to None.
+        **options: Keyword arguments for color_extractor.extract_colors.
+
+    Returns:
+        dict: Number of images "done", "failed" and "skipped".
+    """
+    output_format = output_format or guess_format(output)
+    writer_class = WRITERS[output_format]
+    done = writer_class.done_paths(output) if resume and os.path.exists(output) else set()
+    paths = list(iter_image_paths(source))
+    todo = [path for path in paths if path not in done]
+
+    counts = {"done": 0, "failed": 0, "skipped": len(paths) - len(todo)}
+    writer = writer_class(output, append=resume)
+    start = last_report = time.perf_counter()
+    try:
+        for result in extract_palettes(todo, processes, cache=cache, cam_lut=cam_lut, **options):
+            writer.write(result)
+            counts["failed" if "error" in result else "done"] += 1
+            now = time.perf_counter()
+            if now - last_report >= progress_every:
+                finished = counts["done"] + counts["failed"]
+                print(f"{finished}/{len(todo)} images, {counts['failed']} failed, "
+                      f"{finished / (now - start):.1f} images/s", file=sys.stderr)
+                last_report = now
+    finally:
+        writer.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="Directory of images, or a text file with one image path per line")
+    parser.add_argument("output", help="Output .csv / .jsonl file, or a directory for parquet")
+    parser.add_argument("--format", choices=FORMATS, help="Output format (default: from the output extension)")
+    parser.add_argument("--processes", type=int, help="Worker processes (default: number of CPUs)")
+    parser.add_argument("--no-resume", action="store_true", help="Replace the output instead of adding to it")
+    parser.add_argument("--max-img-size", type=int, default=150)
+    parser.add_argument("--clusters", type=int, default=10)
+    parser.add_argument("--max-colors", type=int, default=7)
+    parser.add_argument("--engine", help="Clustering engine (see color_extractor.PALETTE_ENGINES)")
+    parser.add_argument("--cache", choices=("exact", "perceptual"),
+                        help="Reuse palettes of identical (or near-identical) images from tabs.palette_cache")
+    parser.add_argument("--cam-lut", help="Build (once) or reuse this ~200 MB lookup table to convert colors "
+                                          "faster (default: $CAM_LUT_PATH, else off)")
+    args = parser.parse_args()
+
+    counts = run_batch(args.source, args.output, args.format, args.processes, not args.no_resume,
+                       cache=args.cache, cam_lut=args.cam_lut, max_img_size=args.max_img_size,
+                       n_clusters=args.clusters, max_colors=args.max_colors, engine=args.engine)
+    print(f"{counts['done']} palettes written, {counts['failed']} failed, {counts['skipped']} already done",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Persistent cache of extracted palettes, keyed by image content and extraction parameters."""
+
+import contextlib
+import hashlib
+import io
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: single O_APPEND writes are still not interleaved
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from cache import ResultCache, content_key
+from tabs import color_extractor
+
+# Bump when a change to color_extractor changes the palettes it returns
+PALETTE_CACHE_VERSION = 1
+# Palettes are small, so a few MB in memory hold thousands; the disk tier survives restarts
+PALETTE_CACHE = ResultCache(max_bytes=int(os.environ.get("PALETTE_CACHE_MAX_BYTES", 8 << 20)),
+                            ttl=int(os.environ.get("PALETTE_CACHE_TTL", 30 * 24 * 3600)),
+                            disk_dir=os.environ.get("PALETTE_CACHE_DIR", "palette_cache") or None,
+                            max_disk_bytes=int(os.environ.get("PALETTE_CACHE_MAX_DISK_BYTES", 64 << 20)))
+# Images whose difference hashes differ in at most this many of 64 bits count as the same image
+PERCEPTUAL_MAX_DISTANCE = 4
+# Most recent perceptual hashes kept per parameter set
+PERCEPTUAL_INDEX_SIZE = 10_000
+DEFAULT_PARAMS = {"max_img_size": 150, "n_clusters": 10, "max_colors": 7, "min_dist_cutoff": 8,
+                  "engine": None, "merge_threshold": None}
+_indexes = {}
+_indexes_lock = threading.Lock()
+perceptual_hits = 0
+
+
+def difference_hash(image, hash_size=8):
+    """Compute the difference hash (dHash) of an image
+
+    The image is shrunk to hash_size + 1 by hash_size gray pixels, and each bit records
+    whether a pixel is brighter than its left neighbour. Re-encoding, resizing and small
+    color shifts leave most bits unchanged.
+
+    Parameters
+    ----------
+    image : PIL.Image
+        PIL Image
+
+    hash_size : int, optional
+        rows of the hash, by default 8 (a 64-bit hash)
+
+    Returns
+    -------
+    int
+        the hash as an unsigned integer
+    """
+    small = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distances(hashes, query):
+    """Number of differing bits between each of hashes and query
+
+    Parameters
+    ----------
+    hashes : list
+        64-bit hashes
+
+    query : int
+        64-bit hash
+
+    Returns
+    -------
+    np.array
+        distance to each hash
+    """
+    differences = np.array(hashes, dtype=np.uint64) ^ np.uint64(query)
+    return np.unpackbits(differences.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _params(params):
+    params = {**DEFAULT_PARAMS, **params}
+    params["engine"] = params["engine"] or color_extractor.PALETTE_ENGINE
+    return params
+
+
+def _params_key(params):
+    return content_key("palette", PALETTE_CACHE_VERSION, *(f"{name}={params[name]}" for name in sorted(params)))
+
+
+class PerceptualIndex:
+    """Most recent (difference hash, cache key) pairs of one parameter set
+
+    With a path, pairs are appended to a file shared by every process using the cache
+    directory, and each process reads only the records added since it last looked.
+    Once the file holds twice max_size records it is rewritten with the newest max_size.
+
+    Parameters
+    ----------
+    path : str, optional
+        index file, by default None (the index lives in this process only)
+
+    max_size : int, optional
+        pairs kept, by default PERCEPTUAL_INDEX_SIZE
+    """
+
+    RECORD = np.dtype([("hash", ">u8"), ("key", "u1", 32)])
+
+    def __init__(self, path=None, max_size=PERCEPTUAL_INDEX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._records = np.empty(0, dtype=self.RECORD)
+        self._inode = None
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def find(self, image_hash, max_distance=PERCEPTUAL_MAX_DISTANCE):
+        """Cache keys of indexed images within max_distance bits of image_hash, closest first"""
+        with self._lock:
+            self._refresh()
+            records = self._records
+        if not len(records):
+            return []
+        distances = hamming_distances(records["hash"], image_hash)
+        order = np.argsort(distances, kind="stable")
+        return [records["key"][i].tobytes().hex() for i in order[distances[order] <= max_distance]]
+
+    def add(self, image_hash, key):
+        """Index the image with difference hash image_hash, cached under key"""
+        record = np.array([(image_hash, np.frombuffer(bytes.fromhex(key), dtype=np.uint8))], dtype=self.RECORD)
+        with self._lock:
+            if self.path is None:
+                self._records = np.concatenate([self._records, record])[-self.max_size:]
+                return
+            with self._file_lock():
+                with open(self.path, 'ab') as file:
+                    file.write(record.tobytes())
+                    size = file.tell()
+                if size >= 2 * self.max_size * self.RECORD.itemsize:
+                    self._compact()
+
+    def _refresh(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'rb') as file:
+                inode = os.fstat(file.fileno()).st_ino
+                if inode != self._inode:  # new file, or rewritten by _compact
+                    self._records, self._inode, self._offset = self._records[:0], inode, 0
+                file.seek(self._offset)
+                data = file.read()
+        except FileNotFoundError:
+            return
+        whole = len(data) - len(data) % self.RECORD.itemsize  # a record still being appended
+        self._offset += whole
+        self._records = np.concatenate([self._records, np.frombuffer(data[:whole], dtype=self.RECORD)])
+        self._records = self._records[-self.max_size:]
+
+    def _compact(self):
+        with open(self.path, 'rb') as file:
+            records = np.frombuffer(file.read(), dtype=self.RECORD)[-self.max_size:]
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(records.tobytes())
+        os.replace(tmp_path, self.path)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        with open(self.path + ".lock", 'a') as lock:  # closing it releases the lock
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+
+def perceptual_index(params_key):
+    """The PerceptualIndex of a parameter set, kept next to the disk tier of PALETTE_CACHE if it has one"""
+    with _indexes_lock:
+        if params_key not in _indexes:
+            disk_dir = PALETTE_CACHE.disk_dir
+            path = os.path.join(disk_dir, f"perceptual-{params_key}.idx") if disk_dir else None
+            _indexes[params_key] = PerceptualIndex(path)
+        return _indexes[params_key]
+
+
+def _find_similar(params_key, image_hash):
+    for key in perceptual_index(params_key).find(image_hash):
+        palette = PALETTE_CACHE.get(key)
+        if palette is not None:
+            return palette
+    return None
+
+
+def cached_extract_colors(image_bytes, perceptual=False, **params):
+    """Extract a color palette, reusing the result for images seen before
+
+    Parameters
+    ----------
+    image_bytes : bytes or str
+        encoded image, or the path of an image file
+
+    perceptual : bool, optional
+        also reuse palettes of near-identical images (e.g. the same photo re-encoded as
+        JPEG), matched by difference hash, by default False
+
+    **params
+        keyword arguments for color_extractor.extract_colors; they are part of the cache key
+
+    Returns
+    -------
+    pd.DataFrame
+        palette, as returned by color_extractor.extract_colors
+    """
+    global perceptual_hits
+    if isinstance(image_bytes, str):
+        with open(image_bytes, 'rb') as file:
+            image_bytes = file.read()
+    params = _params(params)
+    params_key = _params_key(params)
+    key = content_key(params_key, hashlib.sha256(image_bytes).hexdigest())
+    palette = PALETTE_CACHE.get(key)
+    if palette is not None:
+        return pd.DataFrame(palette)
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        # JPEGs can be decoded straight at a fraction of their size (as tabs.palette_batch does)
+        image.draft("RGB", (params["max_img_size"], params["max_img_size"]))
+        image_hash = difference_hash(image) if perceptual else None
+        palette = _find_similar(params_key, image_hash) if perceptual else None
+        if palette is not None:
+            perceptual_hits += 1
+        else:
+            palette = color_extractor.extract_colors(image, **params).to_dict(orient="list")
+            if perceptual:
+                perceptual_index(params_key).add(image_hash, key)
+    PALETTE_CACHE.set(key, palette)
+    return pd.DataFrame(palette)
+
+
+def cache_stats():
+    """Hit/miss counters of the palette cache, including near-identical (perceptual) hits."""
+    return {**PALETTE_CACHE.stats(), "perceptual_hits": perceptual_hits}